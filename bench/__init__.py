@@ -0,0 +1 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
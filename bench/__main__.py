@@ -0,0 +1,8 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import sys
+
+import bench.seat_rush
+
+
+bench.seat_rush.main(sys.argv[1:])
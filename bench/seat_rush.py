@@ -0,0 +1,317 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+# Simulates the rush when signup opens: many students log in, look at the
+# lecture page and reserve a seat at the same time, while admins refresh
+# large tables and others submit quizzes. Runs fully offline against a
+# server on a temporary database.
+
+import argparse
+import asyncio
+import datetime
+import html
+import json
+import math
+import os
+import os.path
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import aiohttp.web
+
+import cig.db
+import cig.mail
+
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+ADMIN = "niklas.fiekas@tu-clausthal.de"
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def request(self, session: aiohttp.ClientSession, route: str, method: str, url: str, **kwargs: Any) -> str:
+        start = time.perf_counter()
+        async with session.request(method, url, **kwargs) as res:
+            text = await res.text()
+        self.record(route, time.perf_counter() - start, error=res.status >= 400)
+        return text
+
+    def record(self, route: str, seconds: float, *, error: bool = False) -> None:
+        self.samples.setdefault(route, []).append(seconds)
+        if error:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            samples.sort()
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors.get(route, 0),
+                "throughput": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            "elapsed_s": elapsed,
+            "requests": total,
+            "throughput": total / elapsed,
+            "routes": routes,
+        }
+
+
+def percentile(samples: List[float], p: float) -> float:
+    # Nearest rank on sorted samples.
+    return samples[max(0, min(len(samples) - 1, math.ceil(p / 100 * len(samples)) - 1))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def generate_data(path: str, *, lectures: int, seats: int, statements: int, today: datetime.date) -> List[str]:
+    ids = ["complexity"] + [f"bench{i}" for i in range(lectures)]
+    events = []
+    for n, lecture in enumerate(ids):
+        # One event today, plus a busy admin window around it.
+        for offset in range(-14, 15, 2):
+            events.append({
+                "id": (n + 1) * 1000 + offset + 14,
+                "lecture": lecture,
+                "date": (today + datetime.timedelta(days=offset)).isoformat(),
+                "title": f"Benchmark Lecture {offset:+d}",
+                "location": "Audimax",
+                "seats": seats,
+            })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "lectures": [{"id": lecture, "title": f"Benchmark {lecture}", "lecturer": "Benchmark"} for lecture in ids],
+            "events": events,
+            "admins": [ADMIN],
+            "quizzes": [{
+                "id": "bench",
+                "lecture": "complexity",
+                "statements": [{"text": f"{i} is prime.", "truth": all(i % d for d in range(2, i))} for i in range(2, statements + 2)],
+            }],
+        }, f)
+    return ids
+
+
+def letters(n: int) -> str:
+    # Email addresses must not contain digits.
+    result = ""
+    while True:
+        n, r = divmod(n, 26)
+        result = chr(ord("a") + r) + result
+        if not n:
+            return result
+
+
+def extract_link(page: str) -> str:
+    match = re.search(r"Continue here: (\S+)", page)
+    if not match:
+        raise RuntimeError("no magic link in response (is dev mode enabled?)")
+    return html.unescape(match.group(1))
+
+
+async def login(rec: Recorder, session: aiohttp.ClientSession, route: str, url: str, email: str, mailbox: Optional[List[cig.mail.Message]], timeout: float = 30) -> str:
+    page = await rec.request(session, route, "POST", url, data={"email": email})
+    if mailbox is None:
+        return extract_link(page)
+
+    # Wait for the message to arrive at the fake Mailgun.
+    start = time.perf_counter()
+    path = f"{urlsplit(url).path}?"
+    while time.perf_counter() - start < timeout:
+        for message in reversed(mailbox):
+            if message.to == email and path in message.text:
+                rec.record("mail delivery", time.perf_counter() - start)
+                return extract_link(message.text)
+        await asyncio.sleep(0.01)
+    rec.record("mail delivery", time.perf_counter() - start, error=True)
+    raise RuntimeError(f"no login link for {email} received")
+
+
+def extract_event(page: str) -> Optional[str]:
+    match = re.search(r'name="reserve" value="(\d+)"', page)
+    return match.group(1) if match else None
+
+
+async def student(rec: Recorder, session: aiohttp.ClientSession, base_url: str, lecture: str, n: int, mailbox: Optional[List[cig.mail.Message]]) -> None:
+    email = f"student.{letters(n)}@tu-clausthal.de"
+    link = await login(rec, session, "POST /{lecture} login", f"{base_url}/{lecture}", email, mailbox)
+    page = await rec.request(session, "GET /{lecture}", "GET", link)
+    event = extract_event(page)
+    if event is not None:
+        await rec.request(session, "POST /{lecture} reserve", "POST", link, data={"reserve": event}, allow_redirects=False)
+    await rec.request(session, "GET /{lecture}", "GET", link)
+
+
+async def admin(rec: Recorder, session: aiohttp.ClientSession, base_url: str, lecture: str, refreshes: int, mailbox: Optional[List[cig.mail.Message]]) -> None:
+    link = await login(rec, session, "POST /{lecture} login", f"{base_url}/{lecture}", ADMIN, mailbox) + "&admin=yes"
+    for _ in range(refreshes):
+        await rec.request(session, "GET /{lecture} admin", "GET", link)
+        await asyncio.sleep(random.uniform(0, 0.1))
+
+
+async def quiz(rec: Recorder, session: aiohttp.ClientSession, base_url: str, n: int, mailbox: Optional[List[cig.mail.Message]]) -> None:
+    email = f"quiz.{letters(n)}@tu-clausthal.de"
+    link = await login(rec, session, "POST /{lecture}/quiz/{quiz} login", f"{base_url}/complexity/quiz/bench", email, mailbox)
+    page = await rec.request(session, "GET /{lecture}/quiz/{quiz}", "GET", link)
+    answers = {name: random.choice("01") for name in set(re.findall(r'name="(stmt-\d+)"', page))}
+    await rec.request(session, "POST /{lecture}/quiz/{quiz}", "POST", link, data=answers)
+
+
+async def wait_for_server(base_url: str, proc: "subprocess.Popen[bytes]", timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with {proc.returncode}")
+            try:
+                async with session.get(f"{base_url}/robots.txt") as res:
+                    if res.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+async def run(args: argparse.Namespace, base_url: str, lectures: List[str], mailbox: Optional[List[cig.mail.Message]]) -> Dict[str, Any]:
+    rec = Recorder()
+    connector = aiohttp.TCPConnector(limit=args.students + args.admins + args.quizzes)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(student(rec, session, base_url, lectures[n % len(lectures)], n, mailbox) for n in range(args.students)),
+            *(admin(rec, session, base_url, lectures[n % len(lectures)], args.refreshes, mailbox) for n in range(args.admins)),
+            *(quiz(rec, session, base_url, n, mailbox) for n in range(args.quizzes)),
+        )
+        return rec.report(time.perf_counter() - start)
+
+
+async def serve(args: argparse.Namespace, base_url: str, lectures: List[str], proc: "subprocess.Popen[bytes]", mail_port: int) -> Dict[str, Any]:
+    mailbox: Optional[List[cig.mail.Message]] = None
+    runner: Optional[aiohttp.web.AppRunner] = None
+    if args.mail == "fake":
+        app = cig.mail.fake_mailgun()
+        mailbox = app["messages"]
+        runner = aiohttp.web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await aiohttp.web.TCPSite(runner, "127.0.0.1", mail_port).start()
+    try:
+        await wait_for_server(base_url, proc)
+        return await run(args, base_url, lectures, mailbox)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print(f"{'route':<32} {'p50':>16} {'p95':>16} {'p99':>16}")
+    for route, stats in result["routes"].items():
+        base = baseline["routes"].get(route)
+        cells = []
+        for key in ["p50_ms", "p95_ms", "p99_ms"]:
+            if base:
+                cells.append(f"{stats[key]:7.1f} ({stats[key] / base[key] - 1:+5.0%})" if base[key] else f"{stats[key]:7.1f}")
+            else:
+                cells.append(f"{stats[key]:7.1f}")
+        print(f"{route:<32} {cells[0]:>16} {cells[1]:>16} {cells[2]:>16}")
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Seat rush load test against a local server.")
+    parser.add_argument("--students", type=int, default=200, help="concurrent students (default: %(default)s)")
+    parser.add_argument("--admins", type=int, default=4, help="concurrent admins (default: %(default)s)")
+    parser.add_argument("--refreshes", type=int, default=10, help="page refreshes per admin (default: %(default)s)")
+    parser.add_argument("--quizzes", type=int, default=50, help="concurrent quiz submissions (default: %(default)s)")
+    parser.add_argument("--lectures", type=int, default=2, help="generated lectures (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes (default: %(default)s)")
+    parser.add_argument("--mail", choices=["dev", "fake"], default="dev", help="read login links from dev mode pages, or send them through the mailer to a fake Mailgun (default: %(default)s)")
+    parser.add_argument("--engine", choices=["sqlite", "memory"], default="sqlite", help="storage engine (default: %(default)s)")
+    parser.add_argument("--statements", type=int, default=200, help="statements in the quiz (default: %(default)s)")
+    parser.add_argument("--seats", type=int, default=100, help="seats per event (default: %(default)s)")
+    parser.add_argument("--output", "-o", help="write results as JSON")
+    parser.add_argument("--compare", help="previous JSON results to compare with")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("config", nargs="*", help="additional server config files")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="cig-bench-") as tmp:
+        port = free_port()
+        mail_port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        lectures = generate_data(os.path.join(tmp, "data.json"), lectures=args.lectures, seats=args.seats, statements=args.statements, today=cig.db.now().date())
+        with open(os.path.join(tmp, "bench.ini"), "w") as f:
+            f.write("\n".join([
+                "[server]",
+                "bind=127.0.0.1",
+                f"port={port}",
+                f"base_url={base_url}/",
+                f"dev={args.mail == 'dev'}",
+                "secret=bench",
+                f"workers={args.workers}",
+                "[database]",
+                f"engine={args.engine}",
+                f"path={os.path.join(tmp, 'database.db')}",
+                "[data]",
+                f"path={os.path.join(tmp, 'data.json')}",
+                # All requests come from one address, and admins share one
+                # email address. Allow all logins, but still go through the
+                # rate limiters.
+                "[login]",
+                f"email_burst={args.admins + 1}",
+                f"ip_burst={args.students + args.admins + args.quizzes + 1}",
+                "[mailgun]",
+                f"api=http://127.0.0.1:{mail_port}/v3",
+                "domain=bench.example",
+                "key=bench",
+                "",
+            ]))
+
+        with open(os.path.join(tmp, "server.log"), "wb") as log:
+            proc = subprocess.Popen([sys.executable, "-m", "cig", os.path.join(tmp, "bench.ini")] + args.config, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                result = asyncio.run(serve(args, base_url, lectures, proc, mail_port))
+            finally:
+                proc.terminate()
+                proc.wait()
+
+    result["params"] = {key: value for key, value in vars(args).items() if key not in ["output", "compare", "config"]}
+    try:
+        result["version"] = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        result["version"] = None
+
+    print(f"{result['requests']} requests in {result['elapsed_s']:.2f}s ({result['throughput']:.1f} req/s)")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    else:
+        for route, stats in result["routes"].items():
+            print(f"{route:<32} n={stats['requests']:<6} err={stats['errors']:<4} p50={stats['p50_ms']:7.1f}ms p95={stats['p95_ms']:7.1f}ms p99={stats['p99_ms']:7.1f}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
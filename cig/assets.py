@@ -0,0 +1,145 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import dataclasses
+import gzip
+import hashlib
+import importlib
+import mimetypes
+import os
+import os.path
+import re
+
+import aiohttp.web
+
+from types import ModuleType
+from typing import Dict, Optional, Set
+
+brotli: Optional[ModuleType]
+try:
+    brotli = importlib.import_module("brotli")
+except ImportError:
+    brotli = None
+
+
+STATIC_PATH = os.path.join(os.path.dirname(__file__), "..", "static")
+
+PREFIX = "/static/"
+
+# Fingerprinted URLs change with the content, so they can be cached forever.
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Content types that are worth compressing.
+COMPRESSIBLE = {"text/css", "application/javascript", "text/javascript", "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon"}
+
+
+@dataclasses.dataclass
+class Asset:
+    name: str
+    url: str
+    content_type: str
+    etag: str
+    bodies: Dict[str, bytes]  # By content encoding, including identity
+
+
+def fingerprint(name: str, digest: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def compress(data: bytes, content_type: str) -> Dict[str, bytes]:
+    bodies = {"identity": data}
+    if content_type in COMPRESSIBLE:
+        candidates = {"gzip": gzip.compress(data, compresslevel=9)}
+        if brotli is not None:
+            candidates["br"] = brotli.compress(data, quality=11)
+        bodies.update((encoding, body) for encoding, body in candidates.items() if len(body) < len(data))
+    return bodies
+
+
+def build(root: str = STATIC_PATH) -> Dict[str, Asset]:
+    # Hash and precompress everything once. Keyed by path relative to root.
+    assets = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, root).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            assets[name] = Asset(
+                name=name,
+                url=PREFIX + fingerprint(name, digest),
+                content_type=content_type,
+                etag=f"W/\"{digest}\"",  # Weak, because encodings differ
+                bodies=compress(data, content_type),
+            )
+    return assets
+
+
+ASSETS = build()
+
+# Changes whenever any fingerprint changes. Part of the ETag of pages that
+# link assets.
+DIGEST = hashlib.sha1(" ".join(sorted(asset.url for asset in ASSETS.values())).encode("utf-8")).hexdigest()
+
+# Fingerprinted URL path -> asset.
+_by_url = {asset.url[len(PREFIX):]: asset for asset in ASSETS.values()}
+
+FINGERPRINT = re.compile(r"^(.*)\.[0-9a-f]{16}(\.[^./]*)?$")
+
+
+def url(name: str) -> str:
+    return ASSETS[name].url
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    accepted = set()
+    for part in header.split(","):
+        encoding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+
+def negotiate(asset: Asset, header: str) -> str:
+    accepted = accepted_encodings(header)
+    for encoding in ["br", "gzip"]:
+        if encoding in asset.bodies and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+async def handle(req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
+    path = req.match_info["path"]
+    asset: Optional[Asset] = _by_url.get(path)
+    if asset is not None:
+        cache_control = IMMUTABLE
+    else:
+        # Plain names and other fingerprints (from pages rendered before a
+        # deploy, or by a worker that has not been restarted yet) still
+        # work, but must be revalidated.
+        match = FINGERPRINT.match(path)
+        asset = ASSETS.get(match.group(1) + (match.group(2) or "") if match else path)
+        if asset is None:
+            raise aiohttp.web.HTTPNotFound()
+        cache_control = "no-cache"
+
+    headers = {
+        "Cache-Control": cache_control,
+        "ETag": asset.etag,
+        "Vary": "Accept-Encoding",
+    }
+    if asset.etag in req.headers.get("If-None-Match", ""):
+        return aiohttp.web.Response(status=304, headers=headers)
+
+    encoding = negotiate(asset, req.headers.get("Accept-Encoding", ""))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return aiohttp.web.Response(body=asset.bodies[encoding], content_type=asset.content_type, headers=headers)
@@ -0,0 +1,65 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import asyncio
+import gzip
+import zlib
+
+import aiohttp.web
+
+import cig.assets
+
+from typing import Awaitable, Callable, Optional
+
+
+LEVEL = 6
+
+
+def negotiate(req: aiohttp.web.Request) -> Optional[str]:
+    # None if compression is disabled or not accepted.
+    if req.app["compress_min_size"] is None:
+        return None
+    accepted = cig.assets.accepted_encodings(req.headers.get("Accept-Encoding", ""))
+    for encoding in ["gzip", "deflate"]:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=LEVEL)
+    return zlib.compress(body, LEVEL)
+
+
+def enable(req: aiohttp.web.Request, res: aiohttp.web.StreamResponse) -> None:
+    # For streamed pages, before prepare(). Chunks are small, so aiohttp
+    # compresses them as they are written.
+    if req.app["compress_min_size"] is not None:
+        res.headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate(req)
+    if encoding is not None:
+        res.enable_compression(aiohttp.web.ContentCoding(encoding))
+
+
+@aiohttp.web.middleware
+async def middleware(request: aiohttp.web.Request, handler: Callable[[aiohttp.web.Request], Awaitable[aiohttp.web.StreamResponse]]) -> aiohttp.web.StreamResponse:
+    res = await handler(request)
+    min_size = request.app["compress_min_size"]
+    if min_size is None or not isinstance(res, aiohttp.web.Response) or res.prepared or res.content_type != "text/html" or "Content-Encoding" in res.headers:
+        return res
+    body = res.body
+    if not isinstance(body, bytes) or len(body) < min_size:
+        return res
+
+    res.headers["Vary"] = "Accept-Encoding"
+    encoding = negotiate(request)
+    if encoding is None:
+        return res
+
+    # Keep large bodies from stalling the event loop.
+    if len(body) >= request.app["compress_offload_size"]:
+        res.body = await asyncio.get_running_loop().run_in_executor(None, compress, body, encoding)
+    else:
+        res.body = compress(body, encoding)
+    res.headers["Content-Encoding"] = encoding
+    return res
@@ -1,10 +1,16 @@
 # (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
 
+import bisect
 import datetime
 import dataclasses
+import hashlib
+import json
+import types
 
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Sequence, Tuple
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(frozen=True)
 class Lecture:
     id: str
     title: str
@@ -20,7 +26,7 @@ LECTURES = {
 }
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class Event:
     id: int
     lecture: str
@@ -85,5 +91,119 @@ EVENTS = {
 }
 
 
+def pack_answers(answers: Sequence[bool]) -> int:
+    # Bitmask with answer i at bit i. An additional leading bit encodes the
+    # number of answers.
+    mask = 1 << len(answers)
+    for i, answer in enumerate(answers):
+        if answer:
+            mask |= 1 << i
+    return mask
+
+
+def unpack_answers(mask: int) -> List[bool]:
+    return [bool(mask >> i & 1) for i in range(mask.bit_length() - 1)]
+
+
+@dataclasses.dataclass(frozen=True)
+class Statement:
+    text: str
+    truth: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class Quiz:
+    id: str
+    lecture: str
+    description: str
+    statements: Tuple[Statement, ...]
+    truth: int = dataclasses.field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Compiled once, so that scoring is a single XOR and popcount.
+        object.__setattr__(self, "truth", pack_answers([statement.truth for statement in self.statements]))
+
+    def pack(self, true: Iterable[int]) -> int:
+        # Answers from the indexes of statements answered with true.
+        mask = 1 << len(self.statements)
+        for i in true:
+            if 0 <= i < len(self.statements):
+                mask |= 1 << i
+        return mask
+
+    def score(self, answers: int) -> int:
+        # Number of correct answers. The length bits cancel out.
+        return len(self.statements) - bin(answers ^ self.truth).count("1")
+
+
+QUIZZES = {
+    quiz.id: quiz for quiz in [
+        Quiz("complexity", "complexity", "These following are considered basic questions from Informatics III. Use these in your decision, if you're ready to take the course.", (
+            Statement("7 is an odd number.", True),
+            Statement("There is a largest prime.", False),
+            Statement("2 is prime", True),
+        )),
+    ]
+}
+
+
+class Catalogue:
+    def __init__(self, lectures: Iterable[Lecture], events: Iterable[Event], admins: Iterable[str], quizzes: Iterable[Quiz] = ()) -> None:
+        self.admins: FrozenSet[str] = frozenset(admins)
+        self.lectures: Mapping[str, Lecture] = types.MappingProxyType({lecture.id: lecture for lecture in lectures})
+        self.events: Mapping[int, Event] = types.MappingProxyType({event.id: event for event in events})
+        self.quizzes: Mapping[str, Quiz] = types.MappingProxyType({quiz.id: quiz for quiz in quizzes})
+
+        # Identifies the content, for example to derive cache validators.
+        self.digest = hashlib.sha1(repr((sorted(self.admins), sorted(self.lectures.items()), sorted(self.events.items()), sorted(self.quizzes.items()))).encode("utf-8")).hexdigest()
+
+        # Overall and per lecture: events sorted by date, and their dates for
+        # bisection.
+        by_date = sorted(self.events.values(), key=lambda event: (event.date, event.id))
+        self._by_date = ([event.date for event in by_date], tuple(by_date))
+        by_lecture: Dict[str, List[Event]] = {}
+        for event in by_date:
+            by_lecture.setdefault(event.lecture, []).append(event)
+        self._by_lecture: Dict[str, Tuple[List[datetime.date], Tuple[Event, ...]]] = {
+            lecture: ([event.date for event in events], tuple(events)) for lecture, events in by_lecture.items()
+        }
+
+    def all_events_between(self, start: datetime.date, end: datetime.date) -> Tuple[Event, ...]:
+        dates, events = self._by_date
+        return events[bisect.bisect_left(dates, start):bisect.bisect_right(dates, end)]
+
+    def events_between(self, lecture: str, start: datetime.date, end: datetime.date) -> Tuple[Event, ...]:
+        try:
+            dates, events = self._by_lecture[lecture]
+        except KeyError:
+            return ()
+        return events[bisect.bisect_left(dates, start):bisect.bisect_right(dates, end)]
+
+    def events_on(self, lecture: str, date: datetime.date) -> Tuple[Event, ...]:
+        return self.events_between(lecture, date, date)
+
+
+ADMINS = [f"{prefix}@tu-clausthal.de" for prefix in ["dix", "niklas.fiekas", "tobias.ahlbrecht"]]
+
+
+def load(path: str) -> Catalogue:
+    with open(path, encoding="utf-8") as f:
+        data: Dict[str, Any] = json.load(f)
+
+    return Catalogue(
+        (Lecture(str(lecture["id"]), str(lecture["title"]), str(lecture["lecturer"])) for lecture in data["lectures"]),
+        (Event(int(event["id"]), str(event["lecture"]), datetime.date.fromisoformat(event["date"]), str(event["title"]), str(event["location"]), int(event["seats"])) for event in data["events"]),
+        (str(email) for email in data["admins"]),
+        (Quiz(str(quiz["id"]), str(quiz["lecture"]), str(quiz.get("description", "")), tuple(
+            Statement(str(statement["text"]), bool(statement["truth"])) for statement in quiz["statements"]
+        )) for quiz in data.get("quizzes", [])),
+    )
+
+
+# Replaced as a whole when the data file is reloaded. Take a reference once
+# per request to see a consistent catalogue.
+CATALOGUE = Catalogue(LECTURES.values(), EVENTS.values(), ADMINS, QUIZZES.values())
+
+
 def admin(email: str) -> bool:
-    return email in (f"{prefix}@tu-clausthal.de" for prefix in ["dix", "niklas.fiekas", "tobias.ahlbrecht"])
+    return email in CATALOGUE.admins
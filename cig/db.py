@@ -2,80 +2,847 @@
 
 from __future__ import annotations
 
+import abc
+import asyncio
+import collections
+import concurrent.futures
 import os.path
 import datetime
 import sqlite3
 import dataclasses
+import logging
+import threading
 import pytz
 import secrets
 
-from typing import Tuple, Optional, List, Iterator
-from cig.data import Event
+import cig.data
+import cig.metrics
+
+from typing import Optional, List, Callable, TypeVar, Dict, Tuple, Set, AsyncIterator, Mapping
+from urllib.request import pathname2url
+from cig.data import Event, Quiz
+
+
+T = TypeVar("T")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "..", "database.db")
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "schema.sql")
+
+TIMEZONE = pytz.timezone("Europe/Berlin")
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+LedgerUpdate = Callable[[List["Registration"]], List["Registration"]]
+
+# Executed as part of a batched write transaction. Returns the changed event
+# and how to update its ledger entry after the transaction has been committed.
+Operation = Callable[[sqlite3.Connection], Optional[Tuple[int, LedgerUpdate]]]
+
+# Highest seat number of :event that is not taken, or NULL if the event is
+# full. The highest free seat is either :seats itself or directly below a
+# taken seat. Seats above :seats (taken before the capacity was reduced)
+# still count.
+FREE_SEAT = """(
+    SELECT MAX(candidate) FROM (
+        SELECT :seats AS candidate
+        UNION SELECT seat - 1 FROM registrations WHERE event = :event AND seat IS NOT NULL
+    ) WHERE candidate BETWEEN 1 AND :seats
+    AND candidate NOT IN (SELECT seat FROM registrations WHERE event = :event AND seat IS NOT NULL)
+    AND (SELECT COUNT(*) FROM registrations WHERE event = :event AND seat IS NOT NULL) < :seats
+)"""
 
 
 def now() -> datetime.datetime:
-    return datetime.datetime.now(pytz.timezone("Europe/Berlin"))
+    return datetime.datetime.now(TIMEZONE)
+
+
+def timestamp(time: datetime.datetime) -> int:
+    # Microseconds since the epoch, as stored in the database.
+    return (time - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def localtime(timestamp: int) -> datetime.datetime:
+    return (EPOCH + datetime.timedelta(microseconds=timestamp)).astimezone(TIMEZONE)
+
+
+def _add_seats(conn: sqlite3.Connection) -> None:
+    # Materialize seat numbers in databases created before they were
+    # stored, using the same allocation that was previously done on read.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(registrations)")]
+    if "seat" not in columns:
+        conn.execute("ALTER TABLE registrations ADD COLUMN seat INTEGER")
+        seats: Dict[int, int] = {}
+        for id, event in conn.execute("SELECT id, event FROM registrations WHERE NOT deleted ORDER BY id ASC").fetchall():
+            if event not in seats:
+                seats[event] = cig.data.CATALOGUE.events[event].seats if event in cig.data.CATALOGUE.events else 0
+            if seats[event] > 0:
+                conn.execute("UPDATE registrations SET seat = ? WHERE id = ?", (seats[event], id))
+            seats[event] -= 1
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_event_seat ON registrations (event, seat)")
+    conn.execute("CREATE TABLE IF NOT EXISTS event_versions (event INTEGER PRIMARY KEY, version INTEGER NOT NULL)")
+
+
+def _parse_time(value: str) -> int:
+    time = datetime.datetime.fromisoformat(value)
+    return timestamp(time if time.tzinfo is not None else TIMEZONE.localize(time))
+
+
+def _integer_times(conn: sqlite3.Connection) -> None:
+    # ISO strings with timezone to microseconds since the epoch.
+    conn.create_function("parse_time", 1, _parse_time)
+    conn.execute("""CREATE TABLE registrations_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event INTEGER NOT NULL,
+        name VARCHAR(128) NOT NULL,
+        time INTEGER NOT NULL,
+        admin BOOLEAN NOT NULL,
+        deleted BOOLEAN NOT NULL,
+        seat INTEGER
+    )""")
+    conn.execute("INSERT INTO registrations_new (id, event, name, time, admin, deleted, seat) SELECT id, event, name, parse_time(time), admin, deleted, seat FROM registrations")
+    conn.execute("DROP TABLE registrations")
+    conn.execute("ALTER TABLE registrations_new RENAME TO registrations")
+    conn.execute("CREATE UNIQUE INDEX idx_registrations_event_name ON registrations (event, name)")
+    conn.execute("CREATE UNIQUE INDEX idx_registrations_event_seat ON registrations (event, seat)")
+
+
+def _parse_answers(value: str) -> int:
+    return cig.data.pack_answers([bool(int(a)) for a in value.split(",") if a])
+
+
+def _packed_answers(conn: sqlite3.Connection) -> None:
+    # Comma separated 0 and 1 to bitmask.
+    conn.create_function("parse_answers", 1, _parse_answers)
+    conn.execute("""CREATE TABLE quiz_answers_new (
+        id VARCHAR(32) PRIMARY KEY,
+        quiz VARCHAR(128) NOT NULL,
+        correct INTEGER NOT NULL,
+        answers INTEGER NOT NULL,
+        first BOOLEAN NOT NULL
+    )""")
+    conn.execute("INSERT INTO quiz_answers_new (id, quiz, correct, answers, first) SELECT id, quiz, correct, parse_answers(answers), first FROM quiz_answers")
+    conn.execute("DROP TABLE quiz_answers")
+    conn.execute("ALTER TABLE quiz_answers_new RENAME TO quiz_answers")
+
+
+def encode_answers(answers: int) -> bytes:
+    # Little endian, because SQLite integers are limited to 64 bits.
+    return answers.to_bytes((answers.bit_length() + 7) // 8, "little")
+
+
+def decode_answers(data: bytes) -> int:
+    return int.from_bytes(data, "little")
+
+
+def _blob_answers(conn: sqlite3.Connection) -> None:
+    # Integer bitmask to BLOB, for quizzes with many statements.
+    conn.create_function("encode_answers", 1, encode_answers)
+    conn.execute("""CREATE TABLE quiz_answers_new (
+        id VARCHAR(32) PRIMARY KEY,
+        quiz VARCHAR(128) NOT NULL,
+        correct INTEGER NOT NULL,
+        answers BLOB NOT NULL,
+        first BOOLEAN NOT NULL
+    )""")
+    conn.execute("INSERT INTO quiz_answers_new (id, quiz, correct, answers, first) SELECT id, quiz, correct, encode_answers(answers), first FROM quiz_answers")
+    conn.execute("DROP TABLE quiz_answers")
+    conn.execute("ALTER TABLE quiz_answers_new RENAME TO quiz_answers")
+
+
+def _count_submission(conn: sqlite3.Connection, quiz: Quiz, first: bool, answers: int) -> None:
+    # Running totals, updated in the same transaction as each submission.
+    wrong = answers ^ quiz.truth
+    conn.executemany("INSERT INTO quiz_statement_stats (quiz, first, statement, correct, incorrect) VALUES (?, ?, ?, ?, ?) ON CONFLICT (quiz, first, statement) DO UPDATE SET correct = correct + excluded.correct, incorrect = incorrect + excluded.incorrect", [
+        (quiz.id, first, i, 1 - (wrong >> i & 1), wrong >> i & 1) for i in range(len(quiz.statements))
+    ])
+    conn.execute("INSERT INTO quiz_score_stats (quiz, first, score, count) VALUES (?, ?, ?, 1) ON CONFLICT (quiz, first, score) DO UPDATE SET count = count + 1", (quiz.id, first, quiz.score(answers)))
+
+
+def _quiz_statistics(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE quiz_statement_stats (
+        quiz VARCHAR(128) NOT NULL,
+        first BOOLEAN NOT NULL,
+        statement INTEGER NOT NULL,
+        correct INTEGER NOT NULL,
+        incorrect INTEGER NOT NULL,
+        PRIMARY KEY (quiz, first, statement)
+    ) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE quiz_score_stats (
+        quiz VARCHAR(128) NOT NULL,
+        first BOOLEAN NOT NULL,
+        score INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (quiz, first, score)
+    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX idx_quiz_answers_quiz ON quiz_answers (quiz)")
+
+    # Count existing submissions of known quizzes.
+    for id, first, data in conn.execute("SELECT quiz, first, answers FROM quiz_answers").fetchall():
+        quiz = cig.data.CATALOGUE.quizzes.get(id)
+        answers = decode_answers(data)
+        if quiz is not None and answers.bit_length() - 1 == len(quiz.statements):
+            _count_submission(conn, quiz, bool(first), answers)
+
+
+def _name_index(conn: sqlite3.Connection) -> None:
+    # For contact tracing.
+    conn.execute("CREATE INDEX idx_registrations_name_event ON registrations (name, event) WHERE seat IS NOT NULL")
+
 
+def tally(quiz: Quiz, submissions: List[Tuple[bytes, bool]]) -> QuizStatistics:
+    # Recount from raw answers, as a bit matrix with one row per
+    # submission. Submissions to other versions of the quiz (with a different
+    # number of statements) are skipped.
+    import numpy  # Only required for analytics
+
+    n = len(quiz.statements)
+    width = n // 8 + 1
+    submissions = [submission for submission in submissions if len(submission[0]) == width]
+    matrix = numpy.frombuffer(b"".join(answers for answers, _ in submissions), dtype=numpy.uint8).reshape(-1, width)
+    valid = matrix[:, -1] >> (n % 8) == 1
+
+    bits = numpy.unpackbits(matrix[valid], axis=1, bitorder="little")[:, :n].astype(bool)
+    correct = bits == numpy.array([statement.truth for statement in quiz.statements], dtype=bool)
+    scores = correct.sum(axis=1)
+    first = numpy.array([first for _, first in submissions], dtype=bool)[valid]
+
+    def part(mask: numpy.ndarray) -> Tally:
+        counts = correct[mask].sum(axis=0)
+        return Tally(
+            correct=counts.tolist(),
+            incorrect=(int(mask.sum()) - counts).tolist(),
+            scores=numpy.bincount(scores[mask], minlength=n + 1).tolist(),
+        )
+
+    return QuizStatistics(first=part(first), repeat=part(~first))
+
+
+# Bring databases created by earlier versions up to date. The number of
+# applied migrations is stored in PRAGMA user_version. New databases are
+# created from schema.sql, which always reflects the latest version.
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _add_seats,
+    _integer_times,
+    _packed_answers,
+    _blob_answers,
+    _quiz_statistics,
+    _name_index,
+]
+
+
+def migrate(conn: sqlite3.Connection) -> None:
+    # Expects a connection in autocommit mode.
+    version: int = conn.execute("PRAGMA user_version").fetchone()[0]
+    if not version and conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'registrations'").fetchone() is None:
+        with open(SCHEMA_PATH) as schema:
+            conn.executescript(f"BEGIN; {schema.read()}; PRAGMA user_version = {len(MIGRATIONS)}; COMMIT;")
+        return
+
+    if version > len(MIGRATIONS):
+        raise RuntimeError(f"database version {version} is newer than supported ({len(MIGRATIONS)})")
+
+    for migration in MIGRATIONS[version:]:
+        version += 1
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        logging.info("Migrated database to version %d (%s)", version, migration.__name__)
+
+        if migration is MIGRATIONS[-1]:
+            # Reclaim space from rebuilt tables.
+            conn.execute("VACUUM")
+
+
+class Storage(abc.ABC):
+    # Registrations and quizzes. Implemented by Database and
+    # cig.memory.MemoryStorage.
 
-class Database:
     def __init__(self) -> None:
-        self.conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), "..", "database.db"))
+        # Called on the event loop with the ids of changed events, after
+        # changes have been committed.
+        self.listeners: List[Callable[[Set[int]], None]] = []
 
-        with self.conn, open(os.path.join(os.path.dirname(__file__), "..", "schema.sql")) as schema:
-            self.conn.executescript(schema.read())
+        # Monotonic version of each event, bumped with every change of its
+        # registrations. Kept in memory, so that it can be checked without
+        # a query.
+        self.versions: Dict[int, int] = {}
 
-    def maybe_register(self, *, event: int, name: str, admin: bool = False) -> None:
-        with self.conn:
-            try:
-                self.conn.execute("INSERT INTO registrations (event, name, time, admin, deleted) VALUES (?, ?, ?, ?, FALSE)", (event, name, now().isoformat(sep=" "), admin))
-            except sqlite3.IntegrityError:
-                pass
+        # Whether other processes write to the same storage, so that sync()
+        # needs to be polled.
+        self.shared = False
+
+    def close(self) -> None:
+        pass
+
+    async def sync(self) -> None:
+        pass
+
+    def versions_of(self, events: List[Event]) -> List[int]:
+        return [self.versions.get(event.id, 0) for event in events]
+
+    @abc.abstractmethod
+    async def maybe_register(self, *, event: Event, name: str, admin: bool = False) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def restore(self, *, event: Event, name: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, *, event: Event, name: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def bulk_register(self, *, event: Event, names: List[str], admin: bool = True) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def bulk_delete(self, *, event: Event, names: Optional[List[str]] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def bulk_restore(self, *, event: Event, names: Optional[List[str]] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def copy_registrations(self, *, source: Event, target: Event) -> None:
+        ...
+
+    async def registrations(self, *, event: Event) -> Registrations:
+        return (await self.registrations_for(events=[event]))[0]
+
+    @abc.abstractmethod
+    async def registrations_for(self, *, events: List[Event]) -> List[Registrations]:
+        ...
+
+    @abc.abstractmethod
+    def contacts(self, *, name: str, events: List[Event], page_size: int = 1000) -> AsyncIterator[List[Contact]]:
+        ...
+
+    @abc.abstractmethod
+    async def submit_quiz(self, *, quiz: Quiz, name: str, answers: int) -> str:
+        ...
+
+    @abc.abstractmethod
+    async def quiz_submission(self, *, quiz: str, id: str) -> Optional[QuizSubmission]:
+        ...
+
+    @abc.abstractmethod
+    async def quiz_statistics(self, *, quiz: Quiz) -> QuizStatistics:
+        ...
+
+    @abc.abstractmethod
+    async def recompute_quiz_statistics(self, *, quiz: Quiz) -> QuizStatistics:
+        ...
+
+
+# Applied to every connection. Commits are batched, so the writer can afford
+# to be fully durable.
+DEFAULT_PRAGMAS = {
+    "synchronous": "FULL",
+    "busy_timeout": "5000",
+}
+
+
+class Database(Storage):
+    def __init__(self, path: str = DEFAULT_PATH, *, readers: int = 4, ledger_size: int = 64, batch_delay: float = 0.002, shared: bool = False, pragmas: Mapping[str, str] = DEFAULT_PRAGMAS) -> None:
+        super().__init__()
+        self.path = path
+        self.shared = shared
+        self.local = threading.local()
+
+        for key, value in pragmas.items():
+            if not key.isidentifier() or not value.lstrip("-").isalnum():
+                raise ValueError(f"invalid pragma: {key}={value}")
+        self.pragmas = dict(pragmas)
+
+        # Registration writes arriving within batch_delay (or while the
+        # previous batch is being committed) share a single transaction.
+        self.batch_delay = batch_delay
+        self.pending: List[Tuple[Operation, asyncio.Future[None]]] = []
+        self.flusher: Optional[asyncio.Task[None]] = None
+
+        # Write-through cache of registrations, keyed by event id. Entries are
+        # immutable snapshots that are replaced whenever a write commits.
+        self.ledger: collections.OrderedDict[int, Registrations] = collections.OrderedDict()
+        self.ledger_size = ledger_size
+        self.ledger_lock = threading.Lock()
+        self.generations: Dict[int, int] = {}
+
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            conn.execute(f"PRAGMA busy_timeout = {self.pragmas.get('busy_timeout', 5000)}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            migrate(conn)
 
-    def restore(self, *, event: int, name: str) -> None:
-        with self.conn:
-            self.conn.execute("UPDATE registrations SET deleted = FALSE WHERE event = ? AND name = ?", (event, name))
+            self.versions = dict(conn.execute("SELECT event, version FROM event_versions"))
+            self.seen = max(self.versions.values(), default=0)
+        finally:
+            conn.close()
 
-    def delete(self, *, event: int, name: str) -> None:
-        with self.conn:
-            self.conn.execute("UPDATE registrations SET deleted = TRUE WHERE event = ? AND name = ?", (event, name))
+        # Other processes may write to the same database. Their commits are
+        # noticed by polling PRAGMA data_version, which is cheap enough to
+        # check on the event loop before each read.
+        self.watch: Optional[sqlite3.Connection] = None
+        if shared:
+            self.watch = sqlite3.connect(f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro", uri=True)
+            self.data_version: int = self.watch.execute("PRAGMA data_version").fetchone()[0]
 
-    def registrations(self, *, event: Event) -> Registrations:
-        with self.conn:
-            def make_record(row: Tuple[int, int, str, str, bool, bool]) -> Registration:
-                return Registration(row[0], row[1], row[2], datetime.datetime.fromisoformat(row[3]), row[4], row[5])
+        # All writes are serialized on a single thread. Reads use a pool of
+        # read-only connections, which WAL allows to proceed concurrently.
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer", initializer=self._connect)
+        self.readers = concurrent.futures.ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader", initializer=self._connect, initargs=(True, ))
 
-            return Registrations(event, list(map(make_record, self.conn.execute("SELECT id, event, name, time, admin, deleted FROM registrations WHERE event = ? ORDER BY id ASC", (event.id, )))))
+    def _connect(self, readonly: bool = False) -> None:
+        if readonly:
+            conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro", uri=True)
+        else:
+            conn = sqlite3.connect(self.path)
+        for key, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {key} = {value}")
+        self.local.conn = conn
+
+    async def _write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.writer, lambda: fn(self.local.conn))
+
+    async def _read(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.readers, lambda: fn(self.local.conn))
+
+    async def _write_batched(self, op: Operation) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((op, future))
+        if self.flusher is None:
+            self.flusher = loop.create_task(self._flush())
+        await future
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.batch_delay)
+
+        while self.pending:
+            batch, self.pending = self.pending, []
+
+            def write(conn: sqlite3.Connection) -> Set[int]:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    changes = [op(conn) for op, _ in batch]
+                    events = {change[0] for change in changes if change is not None}
+
+                    # Another process may have changed an event since we
+                    # last synced. Then the ledger entry can not be updated
+                    # incrementally.
+                    with self.ledger_lock:
+                        known = {event: self.versions.get(event, 0) for event in events}
+                    stale = {event for event in events if self._stored_version(conn, event) != known[event]}
+
+                    versions = {event: self._bump_version(conn, event) for event in events}
+                for change in changes:
+                    if change is not None and change[0] not in stale:
+                        self._update_ledger(*change)
+                with self.ledger_lock:
+                    for event in stale:
+                        self.generations[event] = self.generations.get(event, 0) + 1
+                        self.ledger.pop(event, None)
+                    self.versions.update(versions)
+                return set(versions)
 
-    def submit_quiz(self, *, quiz: str, name: str, correct: int, answers: List[bool]) -> str:
-        with self.conn:
             try:
-                self.conn.execute("INSERT INTO quiz_participants (quiz, name) VALUES (?, ?)", (quiz, name))
-            except sqlite3.IntegrityError:
-                first = False
+                changed = await self._write(write)
+            except Exception as err:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(err)
             else:
-                first = True
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+                if changed:
+                    for listener in self.listeners:
+                        listener(changed)
+
+        self.flusher = None
+
+    def close(self) -> None:
+        self.writer.shutdown()
+        self.readers.shutdown()
+        if self.watch is not None:
+            self.watch.close()
+
+    async def sync(self) -> None:
+        # Pick up commits of other processes: Drop their events from the
+        # ledger, adopt their versions and notify listeners.
+        if self.watch is None:
+            return
+        data_version = self.watch.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+
+        seen = self.seen
+        rows = await self._read(lambda conn: conn.execute("SELECT event, version FROM event_versions WHERE version > ?", (seen, )).fetchall())
+
+        changed = set()
+        with self.ledger_lock:
+            for event, version in rows:
+                self.seen = max(self.seen, version)
+                if self.versions.get(event, 0) < version:
+                    self.versions[event] = version
+                    self.generations[event] = self.generations.get(event, 0) + 1
+                    self.ledger.pop(event, None)
+                    changed.add(event)
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+
+    def _invalidate(self, event: int) -> None:
+        # Called before each write, so that concurrent loads of the same
+        # event will not be cached.
+        with self.ledger_lock:
+            self.generations[event] = self.generations.get(event, 0) + 1
+
+    def _update_ledger(self, event: int, update: LedgerUpdate) -> None:
+        # Called after each commit. Updates must be idempotent, because a
+        # concurrent load may already have seen the committed write.
+        with self.ledger_lock:
+            self.generations[event] = self.generations.get(event, 0) + 1
+            cached = self.ledger.get(event)
+            if cached is not None:
+                self.ledger[event] = Registrations(cached.event, update(cached.registrations))
+
+    def _stored_version(self, conn: sqlite3.Connection, event: int) -> int:
+        row = conn.execute("SELECT version FROM event_versions WHERE event = ?", (event, )).fetchone()
+        return row[0] if row is not None else 0
+
+    def _bump_version(self, conn: sqlite3.Connection, event: int) -> int:
+        # Versions are allocated from a sequence shared by all events.
+        version: int = conn.execute("SELECT IFNULL(MAX(version), 0) + 1 FROM event_versions").fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO event_versions (event, version) VALUES (?, ?)", (event, version))
+        return version
+
+    def versions_of(self, events: List[Event]) -> List[int]:
+        with self.ledger_lock:
+            return [self.versions.get(event.id, 0) for event in events]
+
+    def _update_rows(self, changes: Dict[int, Tuple[bool, Optional[int]]]) -> LedgerUpdate:
+        # Sets (deleted, seat) of the given registration ids.
+        return lambda registrations: [
+            dataclasses.replace(r, deleted=changes[r.id][0], seat=changes[r.id][1]) if r.id in changes else r for r in registrations
+        ]
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def maybe_register(self, *, event: Event, name: str, admin: bool = False) -> None:
+        time = timestamp(now())
+
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(event.id)
+            promoted = self._promote(conn, event)
+            cursor = conn.execute(f"INSERT OR IGNORE INTO registrations (event, name, time, admin, deleted, seat) VALUES (:event, :name, :time, :admin, FALSE, {FREE_SEAT})", {
+                "event": event.id,
+                "name": name,
+                "time": time,
+                "admin": admin,
+                "seats": event.seats,
+            })
+            if promoted:
+                return event.id, self._snapshot(conn, event)
+            if not cursor.rowcount:
+                return None
+
+            id = cursor.lastrowid
+            assert id is not None
+            seat = conn.execute("SELECT seat FROM registrations WHERE id = ?", (id, )).fetchone()[0]
+            registration = Registration(id, event.id, name, time, admin, False, seat)
+            return event.id, lambda registrations: registrations if registrations and registrations[-1].id >= registration.id else registrations + [registration]
+
+        await self._write_batched(write)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def restore(self, *, event: Event, name: str) -> None:
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(event.id)
+            row = conn.execute("SELECT id FROM registrations WHERE event = ? AND name = ? AND deleted", (event.id, name)).fetchone()
+            if row is None:
+                return None
+
+            id = row[0]
+            changes = self._promote(conn, event)
+            conn.execute(f"UPDATE registrations SET deleted = FALSE, seat = {FREE_SEAT} WHERE id = :id", {"event": event.id, "seats": event.seats, "id": id})
+            changes[id] = (False, conn.execute("SELECT seat FROM registrations WHERE id = ?", (id, )).fetchone()[0])
+            return event.id, self._update_rows(changes)
+
+        await self._write_batched(write)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def delete(self, *, event: Event, name: str) -> None:
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(event.id)
+            row = conn.execute("SELECT id, seat FROM registrations WHERE event = ? AND name = ? AND NOT deleted", (event.id, name)).fetchone()
+            if row is None:
+                return None
+
+            id, seat = row
+            conn.execute("UPDATE registrations SET deleted = TRUE, seat = NULL WHERE id = ?", (id, ))
+            changes = self._promote(conn, event)
+            changes[id] = (True, None)
+            return event.id, self._update_rows(changes)
+
+        await self._write_batched(write)
+
+    def _snapshot(self, conn: sqlite3.Connection, event: Event) -> LedgerUpdate:
+        # Replaces the ledger entry of an event after bulk changes.
+        registrations = [
+            Registration(row[0], row[1], row[2], row[3], bool(row[4]), bool(row[5]), row[6])
+            for row in conn.execute("SELECT id, event, name, time, admin, deleted, seat FROM registrations WHERE event = ? ORDER BY id ASC", (event.id, ))
+        ]
+        return lambda _: registrations
+
+    def _promote(self, conn: sqlite3.Connection, event: Event) -> Dict[int, Tuple[bool, Optional[int]]]:
+        # Fill free seats from the waitlist, in order of registration, for
+        # example after the capacity has been increased. Returns the changes
+        # for _update_rows().
+        waitlist = conn.execute("SELECT id FROM registrations WHERE event = ? AND seat IS NULL AND NOT deleted ORDER BY id ASC LIMIT ?", (event.id, event.seats)).fetchall()
+        if not waitlist:
+            return {}
+        taken = {seat for seat, in conn.execute("SELECT seat FROM registrations WHERE event = ? AND seat IS NOT NULL", (event.id, ))}
+        free = [seat for seat in range(event.seats, 0, -1) if seat not in taken][:max(event.seats - len(taken), 0)]
+        conn.executemany("UPDATE registrations SET seat = ? WHERE id = ?", [(seat, id) for seat, (id, ) in zip(free, waitlist)])
+        return {id: (False, seat) for seat, (id, ) in zip(free, waitlist)}
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def bulk_register(self, *, event: Event, names: List[str], admin: bool = True) -> None:
+        time = timestamp(now())
+
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(event.id)
+            promoted = self._promote(conn, event)
+            cursor = conn.executemany(f"INSERT OR IGNORE INTO registrations (event, name, time, admin, deleted, seat) VALUES (:event, :name, :time, :admin, FALSE, {FREE_SEAT})", [{
+                "event": event.id,
+                "name": name,
+                "time": time,
+                "admin": admin,
+                "seats": event.seats,
+            } for name in names])
+            return (event.id, self._snapshot(conn, event)) if cursor.rowcount or promoted else None
+
+        await self._write_batched(write)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def bulk_delete(self, *, event: Event, names: Optional[List[str]] = None) -> None:
+        # Deletes the given names, or all registrations of the event.
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(event.id)
+            if names is None:
+                cursor = conn.execute("UPDATE registrations SET deleted = TRUE, seat = NULL WHERE event = ? AND NOT deleted", (event.id, ))
+            else:
+                cursor = conn.executemany("UPDATE registrations SET deleted = TRUE, seat = NULL WHERE event = ? AND name = ? AND NOT deleted", [(event.id, name) for name in names])
+            if not cursor.rowcount:
+                return None
+            self._promote(conn, event)
+            return event.id, self._snapshot(conn, event)
+
+        await self._write_batched(write)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def bulk_restore(self, *, event: Event, names: Optional[List[str]] = None) -> None:
+        # Restores the given names, or all deleted registrations of the event,
+        # in order of registration.
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(event.id)
+            selected = set(names) if names is not None else None
+            ids = [id for id, name in conn.execute("SELECT id, name FROM registrations WHERE event = ? AND deleted ORDER BY id ASC", (event.id, )) if selected is None or name in selected]
+            if not ids:
+                return None
+            self._promote(conn, event)
+            conn.executemany(f"UPDATE registrations SET deleted = FALSE, seat = {FREE_SEAT} WHERE id = :id", [{"event": event.id, "seats": event.seats, "id": id} for id in ids])
+            return event.id, self._snapshot(conn, event)
+
+        await self._write_batched(write)
 
-            id = secrets.token_hex(16)
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def copy_registrations(self, *, source: Event, target: Event) -> None:
+        # Registers everyone from source (that is not deleted) for target, in
+        # order of registration.
+        time = timestamp(now())
 
-            self.conn.execute("INSERT INTO quiz_answers (id, quiz, correct, answers, first) VALUES (?, ?, ?, ?, ?)", (
-                id,
-                quiz,
-                correct,
-                ",".join(str(int(a)) for a in answers),
-                first,
-            ))
+        def write(conn: sqlite3.Connection) -> Optional[Tuple[int, LedgerUpdate]]:
+            self._invalidate(target.id)
+            promoted = self._promote(conn, target)
+            cursor = conn.executemany(f"INSERT OR IGNORE INTO registrations (event, name, time, admin, deleted, seat) VALUES (:event, :name, :time, TRUE, FALSE, {FREE_SEAT})", [{
+                "event": target.id,
+                "name": name,
+                "time": time,
+                "seats": target.seats,
+            } for name, in conn.execute("SELECT name FROM registrations WHERE event = ? AND NOT deleted ORDER BY id ASC", (source.id, )).fetchall()])
+            return (target.id, self._snapshot(conn, target)) if cursor.rowcount or promoted else None
 
-            return id
+        await self._write_batched(write)
 
-    def quiz_submission(self, *, quiz: str, id: str) -> Optional[QuizSubmission]:
-        with self.conn:
-            row = self.conn.execute("SELECT id, quiz, correct, answers FROM quiz_answers WHERE id = ? AND quiz = ?", (id, quiz)).fetchone()
-            return QuizSubmission(
-                id=row[0],
-                quiz=row[1],
-                correct=row[2],
-                answers=[bool(int(a)) for a in row[3].split(",")],
-            ) if row is not None else row
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def registrations_for(self, *, events: List[Event]) -> List[Registrations]:
+        await self.sync()
+
+        result: Dict[int, Registrations] = {}
+        generations: Dict[int, int] = {}
+        with self.ledger_lock:
+            for event in events:
+                cached = self.ledger.get(event.id)
+                if cached is None:
+                    generations[event.id] = self.generations.get(event.id, 0)
+                else:
+                    self.ledger.move_to_end(event.id)
+                    result[event.id] = cached if cached.event == event else Registrations(event, cached.registrations)
+
+        if generations:
+            def read(conn: sqlite3.Connection) -> Dict[int, List[Registration]]:
+                grouped: Dict[int, List[Registration]] = {id: [] for id in generations}
+                with conn:
+                    for row in conn.execute(f"SELECT id, event, name, time, admin, deleted, seat FROM registrations WHERE event IN ({', '.join('?' for _ in grouped)}) ORDER BY event ASC, id ASC", list(grouped)):
+                        grouped[row[1]].append(Registration(row[0], row[1], row[2], row[3], bool(row[4]), bool(row[5]), row[6]))
+                return grouped
+
+            loaded = await self._read(read)
+            with self.ledger_lock:
+                for event in events:
+                    if event.id in loaded and event.id not in result:
+                        result[event.id] = Registrations(event, loaded[event.id])
+                        if self.generations.get(event.id, 0) == generations[event.id]:
+                            self.ledger[event.id] = result[event.id]
+                while len(self.ledger) > self.ledger_size:
+                    self.ledger.popitem(last=False)
+
+        return [result[event.id] for event in events]
+
+    async def contacts(self, *, name: str, events: List[Event], page_size: int = 1000) -> AsyncIterator[List[Contact]]:
+        # Everyone who had a seat at the same events as name, paged by
+        # (event, seat). Waitlisted and deleted registrations do not count.
+        if not events:
+            return
+        placeholders = ", ".join("?" for _ in events)
+        after = (0, 0)
+
+        def read(conn: sqlite3.Connection) -> List[Contact]:
+            with conn:
+                return [Contact(*row) for row in conn.execute(f"""
+                    SELECT other.event, other.seat, other.name, other.time
+                    FROM registrations AS me
+                    JOIN registrations AS other ON other.event = me.event AND other.seat IS NOT NULL AND other.id != me.id
+                    WHERE me.name = ? AND me.seat IS NOT NULL AND me.event IN ({placeholders}) AND (other.event, other.seat) > (?, ?)
+                    ORDER BY other.event, other.seat
+                    LIMIT ?""", [name] + [event.id for event in events] + [after[0], after[1], page_size])]
+
+        while True:
+            with cig.metrics.DB_SECONDS.time("contacts"):
+                page = await self._read(read)
+            if not page:
+                return
+            yield page
+            after = page[-1].event, page[-1].seat
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def submit_quiz(self, *, quiz: Quiz, name: str, answers: int) -> str:
+        def write(conn: sqlite3.Connection) -> str:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("INSERT INTO quiz_participants (quiz, name) VALUES (?, ?)", (quiz.id, name))
+                except sqlite3.IntegrityError:
+                    first = False
+                else:
+                    first = True
+
+                id = secrets.token_hex(16)
+
+                conn.execute("INSERT INTO quiz_answers (id, quiz, correct, answers, first) VALUES (?, ?, ?, ?, ?)", (
+                    id,
+                    quiz.id,
+                    quiz.score(answers),
+                    encode_answers(answers),
+                    first,
+                ))
+                _count_submission(conn, quiz, first, answers)
+
+                return id
+
+        return await self._write(write)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def quiz_submission(self, *, quiz: str, id: str) -> Optional[QuizSubmission]:
+        def read(conn: sqlite3.Connection) -> Optional[QuizSubmission]:
+            with conn:
+                row = conn.execute("SELECT id, quiz, correct, answers FROM quiz_answers WHERE id = ? AND quiz = ?", (id, quiz)).fetchone()
+                return QuizSubmission(
+                    id=row[0],
+                    quiz=row[1],
+                    correct=row[2],
+                    answers=decode_answers(row[3]),
+                ) if row is not None else row
+
+        return await self._read(read)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def quiz_statistics(self, *, quiz: Quiz) -> QuizStatistics:
+        def read(conn: sqlite3.Connection) -> QuizStatistics:
+            n = len(quiz.statements)
+            stats = QuizStatistics(first=Tally([0] * n, [0] * n, [0] * (n + 1)), repeat=Tally([0] * n, [0] * n, [0] * (n + 1)))
+            with conn:
+                for first, statement, correct, incorrect in conn.execute("SELECT first, statement, correct, incorrect FROM quiz_statement_stats WHERE quiz = ? AND statement < ?", (quiz.id, n)):
+                    tally = stats.first if first else stats.repeat
+                    tally.correct[statement] = correct
+                    tally.incorrect[statement] = incorrect
+                for first, score, count in conn.execute("SELECT first, score, count FROM quiz_score_stats WHERE quiz = ? AND score <= ?", (quiz.id, n)):
+                    (stats.first if first else stats.repeat).scores[score] = count
+            return stats
+
+        return await self._read(read)
+
+    @cig.metrics.timed(cig.metrics.DB_SECONDS)
+    async def recompute_quiz_statistics(self, *, quiz: Quiz) -> QuizStatistics:
+        # Replaces the running totals, for example after statements have
+        # been changed.
+        def write(conn: sqlite3.Connection) -> QuizStatistics:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                stats = tally(quiz, [(answers, bool(first)) for answers, first in conn.execute("SELECT answers, first FROM quiz_answers WHERE quiz = ?", (quiz.id, ))])
+                conn.execute("DELETE FROM quiz_statement_stats WHERE quiz = ?", (quiz.id, ))
+                conn.execute("DELETE FROM quiz_score_stats WHERE quiz = ?", (quiz.id, ))
+                for first, part in [(True, stats.first), (False, stats.repeat)]:
+                    conn.executemany("INSERT INTO quiz_statement_stats (quiz, first, statement, correct, incorrect) VALUES (?, ?, ?, ?, ?)", [
+                        (quiz.id, first, i, correct, incorrect) for i, (correct, incorrect) in enumerate(zip(part.correct, part.incorrect)) if correct or incorrect
+                    ])
+                    conn.executemany("INSERT INTO quiz_score_stats (quiz, first, score, count) VALUES (?, ?, ?, ?)", [
+                        (quiz.id, first, score, count) for score, count in enumerate(part.scores) if count
+                    ])
+                return stats
+
+        return await self._write(write)
+
+
+@dataclasses.dataclass
+class Contact:
+    event: int
+    seat: int
+    name: str
+    time: int
+
+
+@dataclasses.dataclass
+class Tally:
+    correct: List[int]  # By statement
+    incorrect: List[int]  # By statement
+    scores: List[int]  # Number of submissions by number of correct answers
+
+
+@dataclasses.dataclass
+class QuizStatistics:
+    first: Tally
+    repeat: Tally
 
 
 @dataclasses.dataclass
@@ -83,7 +850,7 @@ class QuizSubmission:
     id: str
     quiz: str
     correct: int
-    answers: List[bool]
+    answers: int  # See cig.data.pack_answers()
 
 
 @dataclasses.dataclass
@@ -91,18 +858,21 @@ class Registration:
     id: int
     event: int
     name: str
-    time: datetime.datetime
+    time: int
     admin: bool
     deleted: bool
+    seat: Optional[int]
 
 
-@dataclasses.dataclass
 class Row:
-    n: Optional[int]
-    name: str
-    time: datetime.datetime
-    admin: bool
-    deleted: bool
+    __slots__ = ("n", "name", "time", "admin", "deleted")
+
+    def __init__(self, n: Optional[int], name: str, time: int, admin: bool, deleted: bool) -> None:
+        self.n = n
+        self.name = name
+        self.time = time
+        self.admin = admin
+        self.deleted = deleted
 
 
 class Registrations:
@@ -110,14 +880,42 @@ class Registrations:
         self.event = event
         self.registrations = registrations
 
-    def rows(self) -> Iterator[Row]:
-        n = self.event.seats
-        for registration in self.registrations:
+        # Seats are assigned when writing. Waitlisted rows are numbered
+        # 0, -1, -2, ... in order of registration (overhang).
+        self._rows: List[Row] = []
+        self._index: Dict[str, Row] = {}
+        seated = 0
+        waitlist = 0
+        for registration in registrations:
             if registration.deleted:
-                yield Row(None, registration.name, registration.time, registration.admin, True)
+                n: Optional[int] = None
+            elif registration.seat is not None:
+                n = registration.seat
+                seated += 1
             else:
-                yield Row(n, registration.name, registration.time, registration.admin, False)
-                n -= 1
+                n = waitlist
+                waitlist -= 1
+            row = Row(n, registration.name, registration.time, registration.admin, registration.deleted)
+            self._rows.append(row)
+            self._index[row.name] = row
+        self._free = max(event.seats - seated, 0)
+        self._waitlist = -waitlist
+
+    def rows(self) -> List[Row]:
+        return self._rows
+
+    def row(self, name: str) -> Optional[Row]:
+        return self._index.get(name)
 
     def has(self, email: str) -> bool:
-        return any(row.name == email for row in self.rows())
+        return email in self._index
+
+    def seat(self, name: str) -> Optional[int]:
+        row = self._index.get(name)
+        return row.n if row is not None else None
+
+    def free_seats(self) -> int:
+        return self._free
+
+    def waitlist_length(self) -> int:
+        return self._waitlist
@@ -0,0 +1,74 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import cig.data
+import cig.db
+
+from typing import Dict, Iterable, List, Optional, Set
+
+
+def message(registrations: cig.db.Registrations, *, kind: str = "seats") -> bytes:
+    return "event: {}\ndata: {}\n\n".format(kind, json.dumps({
+        "event": registrations.event.id,
+        "seats": registrations.event.seats,
+        "free": registrations.free_seats(),
+        "waitlist": registrations.waitlist_length(),
+    })).encode("utf-8")
+
+
+class Broadcast:
+    # Fans out seat changes to Server-Sent Event subscribers, grouped by
+    # lecture. Each message is serialized once for all subscribers.
+
+    def __init__(self, db: cig.db.Storage, *, queue_size: int = 64) -> None:
+        self.db = db
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, Set[asyncio.Queue[Optional[bytes]]]] = {}
+        db.listeners.append(self.changed)
+
+    def subscribe(self, lecture: str) -> asyncio.Queue[Optional[bytes]]:
+        queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(lecture, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, lecture: str, queue: asyncio.Queue[Optional[bytes]]) -> None:
+        subscribers = self.subscribers.get(lecture)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.subscribers[lecture]
+
+    def close(self) -> None:
+        for subscribers in self.subscribers.values():
+            for queue in subscribers:
+                self._put(queue, None)
+
+    def changed(self, events: Set[int]) -> None:
+        catalogue = cig.data.CATALOGUE
+        relevant = [catalogue.events[id] for id in events if id in catalogue.events and catalogue.events[id].lecture in self.subscribers]
+        if relevant:
+            asyncio.ensure_future(self.publish(relevant))
+
+    async def publish(self, events: Iterable[cig.data.Event]) -> None:
+        for registrations in await self.db.registrations_for(events=list(events)):
+            data = message(registrations)
+            for queue in list(self.subscribers.get(registrations.event.lecture, ())):
+                self._put(queue, data)
+
+    def _put(self, queue: asyncio.Queue[Optional[bytes]], data: Optional[bytes]) -> None:
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Slow consumer. It will be disconnected and the browser
+            # reconnects, receiving a fresh snapshot.
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+async def snapshot(db: cig.db.Storage, events: List[cig.data.Event]) -> bytes:
+    return b"".join(message(registrations, kind="snapshot") for registrations in await db.registrations_for(events=events))
@@ -0,0 +1,136 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import abc
+import asyncio
+import dataclasses
+import logging
+import random
+
+import aiohttp
+import aiohttp.web
+
+from typing import List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class Message:
+    to: str
+    subject: str
+    text: str
+
+
+class TransientError(Exception):
+    pass
+
+
+class Transport(abc.ABC):
+    @abc.abstractmethod
+    async def send(self, session: aiohttp.ClientSession, message: Message) -> None:
+        ...
+
+
+class MailgunTransport(Transport):
+    def __init__(self, *, api: str, domain: str, key: str) -> None:
+        self.url = f"{api.rstrip('/')}/{domain}/messages"
+        self.domain = domain
+        self.auth = aiohttp.BasicAuth("api", key)
+
+    async def send(self, session: aiohttp.ClientSession, message: Message) -> None:
+        async with session.post(self.url, auth=self.auth, data={
+            "from": f"CIG Lectures <noreply@{self.domain}>",
+            "to": message.to,
+            "subject": message.subject,
+            "text": message.text,
+        }) as res:
+            text = await res.text()
+            if res.status == 429 or res.status >= 500:
+                raise TransientError(f"{res.status} - {text}")
+            res.raise_for_status()
+
+
+class Mailer:
+    def __init__(self, transport: Transport, *, workers: int = 4, queue_size: int = 1000, retries: int = 5, backoff: float = 1.0) -> None:
+        self.transport = transport
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue[Message]] = None
+        self.retries = retries
+        self.backoff = backoff
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.tasks: List[asyncio.Task[None]] = []
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+
+        # One pooled session shared by all workers, so that connections to
+        # the mail API are reused.
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.workers), timeout=aiohttp.ClientTimeout(total=30))
+        self.tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, *, timeout: float = 10) -> None:
+        assert self.queue is not None
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("Giving up on %d queued messages", self.queue.qsize())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+
+    def enqueue(self, message: Message) -> bool:
+        try:
+            if self.queue is None:
+                raise asyncio.QueueFull
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.error("Dead letter (queue full): %r", message)
+            return False
+        return True
+
+    async def _work(self) -> None:
+        assert self.session is not None and self.queue is not None
+        while True:
+            message = await self.queue.get()
+            try:
+                await self._deliver(self.session, message)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, session: aiohttp.ClientSession, message: Message) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                await self.transport.send(session, message)
+            except (TransientError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                if attempt >= self.retries:
+                    logger.error("Dead letter (%s after %d attempts): %r", err, attempt + 1, message)
+                    return
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning("Sending to %s failed (%s), retrying in %.1fs", message.to, err, delay)
+                await asyncio.sleep(delay)
+            except Exception:
+                logger.exception("Dead letter: %r", message)
+                return
+            else:
+                logger.info("Sent %r to %s", message.subject, message.to)
+                return
+
+
+def fake_mailgun(*, delay: float = 0) -> aiohttp.web.Application:
+    # Local stand-in for the Mailgun API, for tests and benchmarks. Accepted
+    # messages are collected in app["messages"].
+    async def messages(req: aiohttp.web.Request) -> aiohttp.web.Response:
+        form = await req.post()
+        if delay:
+            await asyncio.sleep(delay)
+        req.app["messages"].append(Message(to=str(form["to"]), subject=str(form["subject"]), text=str(form["text"])))
+        return aiohttp.web.json_response({"id": f"<{len(req.app['messages'])}@{req.match_info['domain']}>", "message": "Queued. Thank you."})
+
+    app = aiohttp.web.Application()
+    app["messages"] = []
+    app.router.add_post("/v3/{domain}/messages", messages)
+    return app
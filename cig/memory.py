@@ -0,0 +1,214 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import dataclasses
+import itertools
+import secrets
+import time
+
+import cig.db
+
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from cig.data import Event, Quiz
+from cig.db import Contact, QuizStatistics, QuizSubmission, Registration, Registrations, Tally
+
+
+class MemoryStorage(cig.db.Storage):
+    # Same behavior as cig.db.Database, but nothing is persisted. For
+    # benchmarks and throwaway instances. Changes are applied immediately on
+    # the event loop, so there is no batching and no ledger.
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.next_id = 1
+        # Versions end up in ETags, so they must not repeat after a restart.
+        self.sequence = time.time_ns()
+
+        # Registrations of each event in order of id. Lists are replaced
+        # rather than modified, because they are shared with Registrations.
+        self.events: Dict[int, List[Registration]] = {}
+        self.cache: Dict[int, Registrations] = {}
+        self.index: Dict[Tuple[int, str], int] = {}  # (event, name) -> position
+        self.taken: Dict[int, Set[int]] = {}  # event -> seats
+        self.attended: Dict[str, Set[int]] = {}  # name -> events
+
+        self.answers: Dict[str, Tuple[QuizSubmission, bool]] = {}
+        self.participants: Set[Tuple[str, str]] = set()
+        self.statement_stats: Dict[Tuple[str, bool, int], Tuple[int, int]] = {}
+        self.score_stats: Dict[Tuple[str, bool, int], int] = {}
+
+    def _commit(self, event: int, registrations: List[Registration]) -> None:
+        self.events[event] = registrations
+        self.cache.pop(event, None)
+        self.sequence += 1
+        self.versions[event] = self.sequence
+        for listener in self.listeners:
+            listener({event})
+
+    def _free_seat(self, event: Event) -> Optional[int]:
+        # Same as cig.db.FREE_SEAT.
+        taken = self.taken.get(event.id, set())
+        if len(taken) >= event.seats:
+            return None
+        return max((candidate for candidate in itertools.chain([event.seats], (seat - 1 for seat in taken)) if 1 <= candidate <= event.seats and candidate not in taken), default=None)
+
+    def _insert(self, registrations: List[Registration], event: Event, name: str, time: int, admin: bool) -> bool:
+        if (event.id, name) in self.index:
+            return False
+        seat = self._free_seat(event)
+        if seat is not None:
+            self.taken.setdefault(event.id, set()).add(seat)
+        self.index[(event.id, name)] = len(registrations)
+        self.attended.setdefault(name, set()).add(event.id)
+        registrations.append(Registration(self.next_id, event.id, name, time, admin, False, seat))
+        self.next_id += 1
+        return True
+
+    def _update(self, registrations: List[Registration], i: int, deleted: bool, seat: Optional[int]) -> None:
+        taken = self.taken.setdefault(registrations[i].event, set())
+        taken.discard(registrations[i].seat)
+        if seat is not None:
+            taken.add(seat)
+        registrations[i] = dataclasses.replace(registrations[i], deleted=deleted, seat=seat)
+
+    def _promote(self, registrations: List[Registration], event: Event) -> bool:
+        # Same as cig.db.Database._promote().
+        waitlist = [i for i, r in enumerate(registrations) if r.seat is None and not r.deleted]
+        if not waitlist:
+            return False
+        taken = self.taken.get(event.id, set())
+        free = [seat for seat in range(event.seats, 0, -1) if seat not in taken][:max(event.seats - len(taken), 0)]
+        for seat, i in zip(free, waitlist):
+            self._update(registrations, i, False, seat)
+        return bool(free)
+
+    async def maybe_register(self, *, event: Event, name: str, admin: bool = False) -> None:
+        registrations = list(self.events.get(event.id, []))
+        promoted = self._promote(registrations, event)
+        if self._insert(registrations, event, name, cig.db.timestamp(cig.db.now()), admin) or promoted:
+            self._commit(event.id, registrations)
+
+    async def restore(self, *, event: Event, name: str) -> None:
+        i = self.index.get((event.id, name))
+        registrations = list(self.events.get(event.id, []))
+        if i is None or not registrations[i].deleted:
+            return
+        self._promote(registrations, event)
+        self._update(registrations, i, False, self._free_seat(event))
+        self._commit(event.id, registrations)
+
+    async def delete(self, *, event: Event, name: str) -> None:
+        i = self.index.get((event.id, name))
+        registrations = list(self.events.get(event.id, []))
+        if i is None or registrations[i].deleted:
+            return
+        self._update(registrations, i, True, None)
+        self._promote(registrations, event)
+        self._commit(event.id, registrations)
+
+    async def bulk_register(self, *, event: Event, names: List[str], admin: bool = True) -> None:
+        time = cig.db.timestamp(cig.db.now())
+        registrations = list(self.events.get(event.id, []))
+        promoted = self._promote(registrations, event)
+        if sum(self._insert(registrations, event, name, time, admin) for name in names) or promoted:
+            self._commit(event.id, registrations)
+
+    async def bulk_delete(self, *, event: Event, names: Optional[List[str]] = None) -> None:
+        selected = set(names) if names is not None else None
+        registrations = list(self.events.get(event.id, []))
+        ids = [i for i, r in enumerate(registrations) if not r.deleted and (selected is None or r.name in selected)]
+        if not ids:
+            return
+        for i in ids:
+            self._update(registrations, i, True, None)
+        self._promote(registrations, event)
+        self._commit(event.id, registrations)
+
+    async def bulk_restore(self, *, event: Event, names: Optional[List[str]] = None) -> None:
+        selected = set(names) if names is not None else None
+        registrations = list(self.events.get(event.id, []))
+        ids = [i for i, r in enumerate(registrations) if r.deleted and (selected is None or r.name in selected)]
+        if not ids:
+            return
+        self._promote(registrations, event)
+        for i in ids:
+            self._update(registrations, i, False, self._free_seat(event))
+        self._commit(event.id, registrations)
+
+    async def copy_registrations(self, *, source: Event, target: Event) -> None:
+        time = cig.db.timestamp(cig.db.now())
+        names = [r.name for r in self.events.get(source.id, []) if not r.deleted]
+        registrations = list(self.events.get(target.id, []))
+        promoted = self._promote(registrations, target)
+        if sum(self._insert(registrations, target, name, time, True) for name in names) or promoted:
+            self._commit(target.id, registrations)
+
+    async def registrations_for(self, *, events: List[Event]) -> List[Registrations]:
+        result = []
+        for event in events:
+            cached = self.cache.get(event.id)
+            if cached is None or cached.event != event:
+                cached = self.cache[event.id] = Registrations(event, self.events.get(event.id, []))
+            result.append(cached)
+        return result
+
+    async def contacts(self, *, name: str, events: List[Event], page_size: int = 1000) -> AsyncIterator[List[Contact]]:
+        attended = self.attended.get(name, set())
+        page: List[Contact] = []
+        for event in sorted({event.id for event in events} & attended):
+            registrations = self.events[event]
+            if registrations[self.index[(event, name)]].seat is None:
+                continue
+            for contact in sorted((Contact(event, r.seat, r.name, r.time) for r in registrations if r.seat is not None and r.name != name), key=lambda contact: contact.seat):
+                page.append(contact)
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def _count_submission(self, quiz: Quiz, first: bool, answers: int) -> None:
+        wrong = answers ^ quiz.truth
+        for i in range(len(quiz.statements)):
+            correct, incorrect = self.statement_stats.get((quiz.id, first, i), (0, 0))
+            self.statement_stats[(quiz.id, first, i)] = (correct + 1 - (wrong >> i & 1), incorrect + (wrong >> i & 1))
+        key = (quiz.id, first, quiz.score(answers))
+        self.score_stats[key] = self.score_stats.get(key, 0) + 1
+
+    async def submit_quiz(self, *, quiz: Quiz, name: str, answers: int) -> str:
+        first = (quiz.id, name) not in self.participants
+        self.participants.add((quiz.id, name))
+        id = secrets.token_hex(16)
+        self.answers[id] = (QuizSubmission(id=id, quiz=quiz.id, correct=quiz.score(answers), answers=answers), first)
+        self._count_submission(quiz, first, answers)
+        return id
+
+    async def quiz_submission(self, *, quiz: str, id: str) -> Optional[QuizSubmission]:
+        submission, _ = self.answers.get(id, (None, False))
+        return submission if submission is not None and submission.quiz == quiz else None
+
+    async def quiz_statistics(self, *, quiz: Quiz) -> QuizStatistics:
+        n = len(quiz.statements)
+
+        def part(first: bool) -> Tally:
+            counts = [self.statement_stats.get((quiz.id, first, i), (0, 0)) for i in range(n)]
+            return Tally(
+                correct=[correct for correct, _ in counts],
+                incorrect=[incorrect for _, incorrect in counts],
+                scores=[self.score_stats.get((quiz.id, first, score), 0) for score in range(n + 1)],
+            )
+
+        return QuizStatistics(first=part(True), repeat=part(False))
+
+    async def recompute_quiz_statistics(self, *, quiz: Quiz) -> QuizStatistics:
+        stats = cig.db.tally(quiz, [(cig.db.encode_answers(submission.answers), first) for submission, first in self.answers.values() if submission.quiz == quiz.id])
+        self.statement_stats = {key: value for key, value in self.statement_stats.items() if key[0] != quiz.id}
+        self.score_stats = {key: value for key, value in self.score_stats.items() if key[0] != quiz.id}
+        for first, part in [(True, stats.first), (False, stats.repeat)]:
+            for i, (correct, incorrect) in enumerate(zip(part.correct, part.incorrect)):
+                if correct or incorrect:
+                    self.statement_stats[(quiz.id, first, i)] = (correct, incorrect)
+            for score, count in enumerate(part.scores):
+                if count:
+                    self.score_stats[(quiz.id, first, score)] = count
+        return stats
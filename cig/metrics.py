@@ -0,0 +1,146 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import bisect
+import functools
+import itertools
+import time
+
+import aiohttp.web
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Type, TypeVar, Union, cast
+from types import TracebackType
+
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+# Added to every sample. Metrics are kept per process, so each worker
+# labels its samples with its number.
+COMMON_LABELS: Dict[str, str] = {}
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f'{name}="{escape(value)}"' for name, value in itertools.chain(COMMON_LABELS.items(), zip(names, values)))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str]) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{{{format_labels(self.labels, labels)}}} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float] = BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        # Only increment the matching bucket. Cumulative counts are computed
+        # on exposition, to keep this cheap.
+        try:
+            counts = self.counts[labels]
+        except KeyError:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def time(self, *labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in sorted(self.counts.items()):
+            prefix = format_labels(self.labels, labels)
+            prefix = prefix + "," if prefix else prefix
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"), ), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{{{prefix}le=\"{le}\"}} {total}")
+            lines.append(f"{self.name}_sum{{{prefix[:-1]}}} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{{{prefix[:-1]}}} {total}")
+        return lines
+
+
+class Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc: Optional[BaseException], tb: Optional[TracebackType]) -> None:
+        self.histogram.observe(self.labels, time.perf_counter() - self.start)
+
+
+REQUESTS = Counter("cig_http_requests_total", "HTTP requests by route pattern and status.", ["route", "method", "status"])
+REQUEST_SECONDS = Histogram("cig_http_request_duration_seconds", "HTTP request latency by route pattern.", ["route", "method"])
+DB_SECONDS = Histogram("cig_db_duration_seconds", "Database method latency.", ["method"])
+RENDER_SECONDS = Histogram("cig_render_duration_seconds", "Time to build and render views.", ["view"])
+
+METRICS: List[Union[Counter, Histogram]] = [REQUESTS, REQUEST_SECONDS, DB_SECONDS, RENDER_SECONDS]
+
+
+def expose() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.expose()) + "\n"
+
+
+def timed(histogram: Histogram) -> Callable[[F], F]:
+    def decorator(fn: F) -> F:
+        labels = (fn.__name__, )
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(labels, time.perf_counter() - start)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+@aiohttp.web.middleware
+async def middleware(request: aiohttp.web.Request, handler: Callable[[aiohttp.web.Request], Awaitable[aiohttp.web.StreamResponse]]) -> aiohttp.web.StreamResponse:
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    start = time.perf_counter()
+    status = 500
+    try:
+        res = await handler(request)
+        status = res.status
+        return res
+    except aiohttp.web.HTTPException as err:
+        status = err.status
+        raise
+    finally:
+        REQUEST_SECONDS.observe((route, request.method), time.perf_counter() - start)
+        REQUESTS.inc(route, request.method, str(status))
@@ -0,0 +1,42 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+from __future__ import annotations
+
+import collections
+import time
+
+from typing import Callable, Tuple
+
+
+class RateLimiter:
+    # Token bucket per key. Buckets are kept in order of last use. A bucket
+    # that has been idle long enough to be full again is equivalent to no
+    # bucket and is evicted. Under abuse, the least recently used buckets are
+    # evicted to stay within max_keys.
+
+    def __init__(self, *, burst: int, interval: float, max_keys: int = 10000, clock: Callable[[], float] = time.monotonic) -> None:
+        self.burst = burst
+        self.interval = interval
+        self.ttl = burst * interval
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets: collections.OrderedDict[str, Tuple[float, float]] = collections.OrderedDict()
+
+    def allow(self, key: str) -> bool:
+        now = self.clock()
+        self._evict(now)
+
+        tokens, last = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) / self.interval)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        return allowed
+
+    def _evict(self, now: float) -> None:
+        while self.buckets:
+            key, (_, last) = next(iter(self.buckets.items()))
+            if now - last < self.ttl and len(self.buckets) < self.max_keys:
+                break
+            del self.buckets[key]
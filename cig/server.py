@@ -1,20 +1,38 @@
 # (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
 
+import argparse
+import asyncio
 import os.path
 import configparser
+import csv
+import dataclasses
 import datetime
 import logging
+import hashlib
 import hmac
+import io
+import signal
+import socket
 import textwrap
+import time
 
 import aiohttp
 import aiohttp.web
 
+import cig.assets
+import cig.compress
 import cig.db
+import cig.live
+import cig.mail
+import cig.memory
+import cig.metrics
+import cig.ratelimit
+import cig.supervisor
 import cig.view
 
-from typing import List, Optional
-from cig.data import Lecture
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Mapping, Optional, Tuple, Union
+from cig.data import Catalogue, Lecture, Event, Quiz
+from tinyhtml import Frag
 
 
 def normalize_email(email: str) -> str:
@@ -28,17 +46,71 @@ def normalize_email(email: str) -> str:
     return email
 
 
+def normalize_name(name: str) -> str:
+    name = name.strip()
+    return name.lower() if "@" in name else name
+
+
 def hmac_email(secret: str, email: str) -> str:
     return hmac.new(secret.encode("utf-8"), f"mailto:{email}".encode("utf-8"), "sha256").hexdigest()
 
 
+def render(view: str, page: Callable[[], Frag]) -> str:
+    with cig.metrics.RENDER_SECONDS.time(view):
+        return page().render()
+
+
+async def stream(req: aiohttp.web.Request, view: str, chunks: Iterator[str], *, headers: Dict[str, str], buffer_size: int = 16 * 1024) -> aiohttp.web.StreamResponse:
+    res = aiohttp.web.StreamResponse(headers=headers)
+    res.content_type = "text/html"
+    res.charset = "utf-8"
+    res.enable_chunked_encoding()
+    cig.compress.enable(req, res)
+    await res.prepare(req)
+
+    def fill() -> bytes:
+        buffer: List[str] = []
+        buffered = 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= buffer_size:
+                break
+        return "".join(buffer).encode("utf-8")
+
+    # Only time rendering, not waiting for the client.
+    start = time.perf_counter()
+    data = next(chunks, "").encode("utf-8")
+    rendering = time.perf_counter() - start
+    try:
+        # Send the head of the page right away.
+        while True:
+            await res.write(data)
+            start = time.perf_counter()
+            data = fill()
+            rendering += time.perf_counter() - start
+            if not data:
+                break
+        cig.metrics.RENDER_SECONDS.observe((view, ), rendering)
+
+        await res.write_eof()
+    except ConnectionResetError:
+        pass  # Client went away
+    return res
+
+
+def render_static(view: str, key: Tuple[str, ...], page: Callable[[], Frag]) -> aiohttp.web.Response:
+    with cig.metrics.RENDER_SECONDS.time(view):
+        return aiohttp.web.Response(body=cig.view.static(key, page), content_type="text/html", charset="utf-8")
+
+
 routes = aiohttp.web.RouteTableDef()
 
 
 @routes.get("/")
 async def index(_req: aiohttp.web.Request) -> aiohttp.web.Response:
     # Show list of lectures.
-    return aiohttp.web.Response(text=cig.view.index().render(), content_type="text/html")
+    return render_static("index", ("index", ), cig.view.index)
 
 
 @routes.get("/robots.txt")
@@ -49,9 +121,29 @@ async def robots(_req: aiohttp.web.Request) -> aiohttp.web.Response:
         """))
 
 
+def client_ip(req: aiohttp.web.Request) -> str:
+    if req.app["behind_proxy"]:
+        forwarded = req.headers.get("X-Forwarded-For", "").rsplit(",", 1)[-1].strip()
+        if forwarded:
+            return forwarded
+    return req.remote or ""
+
+
+def send_login_link(req: aiohttp.web.Request, message: cig.mail.Message) -> None:
+    # Repeated requests get the same response, but within the limits no
+    # further email.
+    if req.app["dev"]:
+        return
+    ip = client_ip(req)
+    if not req.app["email_limiter"].allow(message.to) or not req.app["ip_limiter"].allow(ip):
+        logging.warning("Not sending another login link to %s (requested from %s)", message.to, ip)
+        return
+    req.app["mailer"].enqueue(message)
+
+
 def extract_lecture(req: aiohttp.web.Request) -> Lecture:
     try:
-        return cig.data.LECTURES[req.match_info["lecture"]]
+        return cig.data.CATALOGUE.lectures[req.match_info["lecture"]]
     except KeyError:
         raise aiohttp.web.HTTPNotFound(reason="lecture not found")
 
@@ -65,24 +157,161 @@ def extract_verified_email(req: aiohttp.web.Request) -> Optional[str]:
         return None
 
 
+@routes.get("/metrics")
+async def metrics(req: aiohttp.web.Request) -> aiohttp.web.Response:
+    email = extract_verified_email(req)
+    if not email or not cig.data.admin(email):
+        raise aiohttp.web.HTTPForbidden(reason="admin required")
+    return aiohttp.web.Response(text=cig.metrics.expose(), content_type="text/plain", headers={"X-Content-Type-Options": "nosniff"})
+
+
+def visible_events(catalogue: Catalogue, lecture: Lecture, *, admin: bool, today: datetime.date) -> List[Event]:
+    if admin:
+        return list(catalogue.events_between(lecture.id, today - datetime.timedelta(days=14), today + datetime.timedelta(days=14)))
+    else:
+        return list(catalogue.events_on(lecture.id, today))
+
+
+def build_digest() -> str:
+    # Changes with the code, including templates in cig/view.py.
+    digest = hashlib.sha1()
+    package = os.path.dirname(__file__)
+    for name in sorted(os.listdir(package)):
+        if name.endswith(".py"):
+            with open(os.path.join(package, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+BUILD = build_digest()
+
+
+def lecture_etag(catalogue: Catalogue, versions: List[int], *, email: str, admin: bool, today: datetime.date) -> str:
+    # Weak, because the footer contains the server time.
+    key = f"{BUILD}:{catalogue.digest}:{cig.assets.DIGEST}:{email}:{admin}:{today.isoformat()}:{','.join(str(version) for version in versions)}"
+    return 'W/"{}"'.format(hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def etag_matches(req: aiohttp.web.Request, etag: str) -> bool:
+    return any(candidate.strip() in [etag, "*"] for candidate in req.headers.get("If-None-Match", "").split(","))
+
+
+@routes.get("/admin/contacts")
+async def get_contacts(req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
+    # Everyone who had a seat at the same events as name, for example to
+    # answer requests of the health office.
+    email = extract_verified_email(req)
+    if not email or not cig.data.admin(email):
+        raise aiohttp.web.HTTPForbidden(reason="admin required")
+
+    name = normalize_name(req.query.get("name", ""))
+    if not name:
+        raise aiohttp.web.HTTPBadRequest(reason="name required")
+    try:
+        end = datetime.date.fromisoformat(req.query["end"]) if "end" in req.query else cig.db.now().date()
+        start = datetime.date.fromisoformat(req.query["start"]) if "start" in req.query else end - datetime.timedelta(days=14)
+    except ValueError:
+        raise aiohttp.web.HTTPBadRequest(reason="invalid date")
+
+    catalogue = cig.data.CATALOGUE
+    events = list(catalogue.all_events_between(start, end))
+
+    res = aiohttp.web.StreamResponse(headers={
+        "Content-Disposition": f"attachment; filename=\"contacts-{start.isoformat()}-{end.isoformat()}.csv\"",
+        "Cache-Control": "no-store",
+    })
+    res.content_type = "text/csv"
+    res.charset = "utf-8"
+    res.enable_chunked_encoding()
+    await res.prepare(req)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["date", "lecture", "event", "title", "location", "seat", "name", "registered"])
+    try:
+        async for page in req.app["db"].contacts(name=name, events=events):
+            for contact in page:
+                event = catalogue.events[contact.event]
+                writer.writerow([event.date.isoformat(), event.lecture, event.id, event.title, event.location, contact.seat, contact.name, cig.db.localtime(contact.time).isoformat(sep=" ", timespec="seconds")])
+            await res.write(buffer.getvalue().encode("utf-8"))
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            await res.write(buffer.getvalue().encode("utf-8"))
+        await res.write_eof()
+    except ConnectionResetError:
+        pass  # Client went away
+    return res
+
+
 @routes.get("/{lecture}")
-async def get_lecture(req: aiohttp.web.Request) -> aiohttp.web.Response:
+async def get_lecture(req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
     lecture = extract_lecture(req)
     email = extract_verified_email(req)
     admin = email is not None and req.query.get("admin", "") == "yes" and cig.data.admin(email)
     if not email:
         # Show login form.
-        return aiohttp.web.Response(text=cig.view.login_lecture(lecture=lecture).render(), content_type="text/html")
+        return render_static("login_lecture", ("login_lecture", lecture.id), lambda: cig.view.login_lecture(lecture=lecture))
     else:
         # Show registration form.
         today = cig.db.now().date()
-        events = [
-            req.app["db"].registrations(event=event) for event in cig.data.EVENTS.values()
-            if event.lecture == lecture.id and (event.date == today or (admin and abs(event.date - today) <= datetime.timedelta(days=14)))
-        ]
+        catalogue = cig.data.CATALOGUE
+        events = visible_events(catalogue, lecture, admin=admin, today=today)
+
+        # Answer conditional requests without querying or rendering.
+        await req.app["db"].sync()
+        headers = {
+            "ETag": lecture_etag(catalogue, req.app["db"].versions_of(events), email=email, admin=admin, today=today),
+            "Cache-Control": "private, no-cache",
+        }
+        if etag_matches(req, headers["ETag"]):
+            raise aiohttp.web.HTTPNotModified(headers=headers)
+
+        registrations = await req.app["db"].registrations_for(events=events)
+        if admin:
+            # Admin tables can be large. Stream them, to send the head of the
+            # page immediately and keep the render buffer small.
+            return await stream(req, "register", cig.view.register_chunks(lecture=lecture, email=email, events=registrations, admin=admin, today=today), headers=headers)
         return aiohttp.web.Response(
-            text=cig.view.register(lecture=lecture, email=email, events=events, admin=admin, today=today).render(),
-            content_type="text/html")
+            text=render("register", lambda: cig.view.register(lecture=lecture, email=email, events=registrations, admin=admin, today=today)),
+            content_type="text/html",
+            headers=headers)
+
+
+@routes.get("/{lecture}/live")
+async def live_lecture(req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
+    lecture = extract_lecture(req)
+    email = extract_verified_email(req)
+    if not email:
+        raise aiohttp.web.HTTPForbidden(reason="login required")
+    admin = req.query.get("admin", "") == "yes" and cig.data.admin(email)
+
+    res = aiohttp.web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await res.prepare(req)
+
+    broadcast = req.app["broadcast"]
+    queue = broadcast.subscribe(lecture.id)
+    try:
+        await res.write(await cig.live.snapshot(req.app["db"], visible_events(cig.data.CATALOGUE, lecture, admin=admin, today=cig.db.now().date())))
+        while True:
+            try:
+                data = await asyncio.wait_for(queue.get(), timeout=15)
+            except asyncio.TimeoutError:
+                await res.write(b": keep-alive\n\n")
+                continue
+            if data is None:
+                break
+            await res.write(data)
+    except ConnectionResetError:
+        pass
+    finally:
+        broadcast.unsubscribe(lecture.id, queue)
+
+    return res
 
 
 @routes.post("/{lecture}")
@@ -99,7 +328,7 @@ async def post_lecture(req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason="email required")
         except ValueError as err:
-            return aiohttp.web.Response(text=cig.view.login_lecture(lecture=lecture, error=str(err)).render(), content_type="text/html")
+            return aiohttp.web.Response(text=render("login_lecture", lambda: cig.view.login_lecture(lecture=lecture, error=str(err))), content_type="text/html")
 
         token = hmac_email(req.app["secret"], email)
         magic_link = req.app["base_url"].rstrip("/") + cig.view.url(req.match_info["lecture"], email=email, hmac=token)
@@ -112,87 +341,195 @@ async def post_lecture(req: aiohttp.web.Request) -> aiohttp.web.StreamResponse:
             f"---\nAutomated email on behalf of {lecture.lecturer} and team",
         ] if line is not None)
 
-        if not req.app["dev"]:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"https://api.eu.mailgun.net/v3/{req.app['mailgun_domain']}/messages",
-                    auth=aiohttp.BasicAuth("api", req.app["mailgun_key"]),
-                    data={
-                        "from": f"CIG Lectures <noreply@{req.app['mailgun_domain']}>",
-                        "to": email,
-                        "subject": f"Register for the next {lecture.title} lecture (step 2/3)",
-                        "text": email_text,
-                    }
-                ) as res:
-                    print("Response:", res.status, "-", await res.text())
+        send_login_link(req, cig.mail.Message(
+            to=email,
+            subject=f"Register for the next {lecture.title} lecture (step 2/3)",
+            text=email_text,
+        ))
 
         return aiohttp.web.Response(
-            text=cig.view.link_sent(title="Link sent (step 2/3)", email_text=email_text if req.app["dev"] else None).render(),
+            text=render("link_sent", lambda: cig.view.link_sent(title="Link sent (step 2/3)", email_text=email_text if req.app["dev"] else None)),
             content_type="text/html")
     else:
         # Process registration form.
         try:
-            event = cig.data.EVENTS[int(str(form["reserve"]))]
+            event = cig.data.CATALOGUE.events[int(str(form["reserve"]))]
         except (KeyError, ValueError):
             pass
         else:
-            name = str(form.get("name", email)).strip() if admin else email
-            if "@" in name:
-                name = name.lower()
+            name = normalize_name(str(form.get("name", email))) if admin else email
             if name and (admin or event.date == cig.db.now().date()):
-                req.app["db"].maybe_register(event=event.id, name=name, admin=admin)
+                await req.app["db"].maybe_register(event=event, name=name, admin=admin)
 
         # Process admin actions on registration form.
         if admin:
             try:
-                delete = int(str(form["delete"]))
+                delete = cig.data.CATALOGUE.events[int(str(form["delete"]))]
                 name = str(form["name"])
             except (KeyError, ValueError):
                 pass
             else:
-                req.app["db"].delete(event=delete, name=name)
+                await req.app["db"].delete(event=delete, name=name)
 
             try:
-                restore = int(str(form["restore"]))
+                restore = cig.data.CATALOGUE.events[int(str(form["restore"]))]
                 name = str(form["name"])
             except (KeyError, ValueError):
                 pass
             else:
-                req.app["db"].restore(event=restore, name=name)
+                await req.app["db"].restore(event=restore, name=name)
+
+            if "bulk" in form:
+                await bulk_action(req.app["db"], form)
+
+        # Redirect, so that reloading is a cheap conditional GET.
+        raise aiohttp.web.HTTPSeeOther(location=str(req.rel_url))
+
+
+def bulk_names(form: Mapping[str, Union[str, bytes, bytearray, aiohttp.web.FileField]]) -> List[str]:
+    # One name per line, and from an uploaded CSV file: The name or email
+    # column, or the first column if there is no header.
+    lines = str(form.get("names", "")).splitlines()
+    upload = form.get("csv")
+    if isinstance(upload, aiohttp.web.FileField):
+        try:
+            rows = [row for row in csv.reader(io.TextIOWrapper(upload.file, encoding="utf-8-sig")) if row]
+        except (UnicodeDecodeError, csv.Error):
+            raise aiohttp.web.HTTPBadRequest(reason="invalid CSV file")
+        column = 0
+        header = [cell.strip().lower() for cell in rows[0]] if rows else []
+        for key in ["name", "email", "e-mail"]:
+            if key in header:
+                column = header.index(key)
+                rows = rows[1:]
+                break
+        lines.extend(row[column] for row in rows if column < len(row))
+
+    return [name for name in dict.fromkeys(normalize_name(line) for line in lines) if name]
+
+
+async def bulk_action(db: cig.db.Storage, form: Mapping[str, Union[str, bytes, bytearray, aiohttp.web.FileField]]) -> None:
+    catalogue = cig.data.CATALOGUE
+    try:
+        event = catalogue.events[int(str(form["event"]))]
+    except (KeyError, ValueError):
+        raise aiohttp.web.HTTPBadRequest(reason="invalid event")
+
+    action = form["bulk"]
+    if action == "register":
+        await db.bulk_register(event=event, names=bulk_names(form))
+    elif action == "delete":
+        await db.bulk_delete(event=event, names=bulk_names(form))
+    elif action == "delete-all":
+        await db.bulk_delete(event=event)
+    elif action == "restore":
+        await db.bulk_restore(event=event, names=bulk_names(form))
+    elif action == "restore-all":
+        await db.bulk_restore(event=event)
+    elif action == "copy":
+        try:
+            target = catalogue.events[int(str(form["target"]))]
+        except (KeyError, ValueError):
+            raise aiohttp.web.HTTPBadRequest(reason="invalid target event")
+        if target == event:
+            raise aiohttp.web.HTTPBadRequest(reason="cannot copy to the same event")
+        await db.copy_registrations(source=event, target=target)
+    else:
+        raise aiohttp.web.HTTPBadRequest(reason="invalid bulk action")
 
-        return await get_lecture(req)
 
+def extract_quiz(req: aiohttp.web.Request) -> Tuple[Lecture, Quiz]:
+    lecture = extract_lecture(req)
+    quiz = cig.data.CATALOGUE.quizzes.get(req.match_info["quiz"])
+    if quiz is None or quiz.lecture != lecture.id:
+        raise aiohttp.web.HTTPNotFound(reason="quiz not found")
+    return lecture, quiz
+
+
+def single_quiz(lecture: Lecture) -> Optional[Quiz]:
+    quizzes = [quiz for quiz in cig.data.CATALOGUE.quizzes.values() if quiz.lecture == lecture.id]
+    return quizzes[0] if len(quizzes) == 1 else None
+
+
+def redirect(req: aiohttp.web.Request, location: str) -> aiohttp.web.HTTPFound:
+    return aiohttp.web.HTTPFound(location=f"{location}?{req.query_string}" if req.query_string else location)
+
+
+@routes.get("/{lecture}/quiz")
+async def get_quizzes(req: aiohttp.web.Request) -> aiohttp.web.Response:
+    # Links to the single quiz of a lecture used to point here.
+    lecture = extract_lecture(req)
+    quiz = single_quiz(lecture)
+    if quiz is None:
+        raise aiohttp.web.HTTPNotFound(reason="quiz not found")
+    raise redirect(req, cig.view.url(lecture.id, "quiz", quiz.id))
+
+
+def quiz_statistics(quiz: Quiz, stats: cig.db.QuizStatistics) -> aiohttp.web.Response:
+    return aiohttp.web.json_response({
+        "quiz": quiz.id,
+        "statements": [{"text": statement.text, "truth": statement.truth} for statement in quiz.statements],
+        "first": dataclasses.asdict(stats.first),
+        "repeat": dataclasses.asdict(stats.repeat),
+    })
+
+
+@routes.get("/{lecture}/quiz/{quiz}/statistics")
+async def get_quiz_statistics(req: aiohttp.web.Request) -> aiohttp.web.Response:
+    _, quiz = extract_quiz(req)
+    email = extract_verified_email(req)
+    if not email or not cig.data.admin(email):
+        raise aiohttp.web.HTTPForbidden(reason="admin required")
+    return quiz_statistics(quiz, await req.app["db"].quiz_statistics(quiz=quiz))
 
-@routes.get("/complexity/quiz")
-@routes.get("/complexity/quiz/{submission}")
+
+@routes.post("/{lecture}/quiz/{quiz}/statistics")
+async def post_quiz_statistics(req: aiohttp.web.Request) -> aiohttp.web.Response:
+    # Recount from all submissions.
+    _, quiz = extract_quiz(req)
+    email = extract_verified_email(req)
+    if not email or not cig.data.admin(email):
+        raise aiohttp.web.HTTPForbidden(reason="admin required")
+    return quiz_statistics(quiz, await req.app["db"].recompute_quiz_statistics(quiz=quiz))
+
+
+@routes.get("/{lecture}/quiz/{quiz}")
+@routes.get("/{lecture}/quiz/{quiz}/{submission}")
 async def get_quiz(req: aiohttp.web.Request) -> aiohttp.web.Response:
+    if "submission" not in req.match_info and req.match_info["quiz"] not in cig.data.CATALOGUE.quizzes:
+        # Links to results used to be /{lecture}/quiz/{submission}.
+        quiz = single_quiz(extract_lecture(req))
+        if quiz is not None and await req.app["db"].quiz_submission(quiz=quiz.id, id=req.match_info["quiz"]):
+            raise redirect(req, cig.view.url(quiz.lecture, "quiz", quiz.id, req.match_info["quiz"]))
+
+    lecture, quiz = extract_quiz(req)
     email = extract_verified_email(req)
 
     submission = None
     if "submission" in req.match_info:
-        submission = req.app["db"].quiz_submission(quiz="complexity", id=req.match_info["submission"])
+        submission = await req.app["db"].quiz_submission(quiz=quiz.id, id=req.match_info["submission"])
         if not submission:
             raise aiohttp.web.HTTPNotFound(reason="quiz submission not found")
 
     if email or submission:
         # Show quiz.
         return aiohttp.web.Response(
-            text=cig.view.quiz(
+            text=render("quiz", lambda: cig.view.quiz(
+                lecture=lecture,
+                quiz=quiz,
                 email=email,
-                statements=cig.example_quiz.STATEMENTS,
-                answers=submission.answers if submission else None,
+                answers=cig.data.unpack_answers(submission.answers) if submission else None,
                 correct=submission.correct if submission else None,
-            ).render(),
+            )),
             content_type="text/html")
     else:
         # Show login form
-        return aiohttp.web.Response(
-            text=cig.view.login_quiz(lecture=cig.data.LECTURES["complexity"]).render(),
-            content_type="text/html")
+        return render_static("login_quiz", ("login_quiz", lecture.id, quiz.id), lambda: cig.view.login_quiz(lecture=lecture))
 
 
-@routes.post("/complexity/quiz")
+@routes.post("/{lecture}/quiz/{quiz}")
 async def post_quiz(req: aiohttp.web.Request) -> aiohttp.web.Response:
+    lecture, quiz = extract_quiz(req)
     email = extract_verified_email(req)
     form = await req.post()
 
@@ -203,65 +540,214 @@ async def post_quiz(req: aiohttp.web.Request) -> aiohttp.web.Response:
         except KeyError:
             raise aiohttp.web.HTTPBadRequest(reason="email required")
         except ValueError as err:
-            return aiohttp.web.Response(text=cig.view.login_quiz(lecture=cig.data.LECTURES["complexity"], error=str(err)).render(), content_type="text/html")
+            return aiohttp.web.Response(text=render("login_quiz", lambda: cig.view.login_quiz(lecture=lecture, error=str(err))), content_type="text/html")
 
         token = hmac_email(req.app["secret"], email)
-        magic_link = req.app["base_url"].rstrip("/") + cig.view.url("complexity", "quiz", email=email, hmac=token)
+        magic_link = req.app["base_url"].rstrip("/") + cig.view.url(lecture.id, "quiz", quiz.id, email=email, hmac=token)
         print(magic_link)
 
         email_text = "\n\n".join(line for line in [
             f"Continue here: {magic_link}",
-            f"---\nAutomated email on behalf of Jürgen Dix and team",
+            f"---\nAutomated email on behalf of {lecture.lecturer} and team",
         ] if line is not None)
 
-        if not req.app["dev"]:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"https://api.eu.mailgun.net/v3/{req.app['mailgun_domain']}/messages",
-                    auth=aiohttp.BasicAuth("api", req.app["mailgun_key"]),
-                    data={
-                        "from": f"CIG Lectures <noreply@{req.app['mailgun_domain']}>",
-                        "to": email,
-                        "subject": f"Self assessment quiz for Complexity Theory",
-                        "text": email_text,
-                    }
-                ) as res:
-                    print("Response:", res.status, "-", await res.text())
+        send_login_link(req, cig.mail.Message(
+            to=email,
+            subject=f"Self assessment quiz for {lecture.title}",
+            text=email_text,
+        ))
 
         return aiohttp.web.Response(
-            text=cig.view.link_sent(title="Link sent", email_text=email_text if req.app["dev"] else None).render(),
+            text=render("link_sent", lambda: cig.view.link_sent(title="Link sent", email_text=email_text if req.app["dev"] else None)),
             content_type="text/html")
     else:
-        answers = []
-        correct = 0
-        for i, statement in enumerate(cig.example_quiz.STATEMENTS):
-            answer = form.get(f"stmt-{i}", "") == "1"
-            answers.append(answer)
-            correct += answer == statement.truth
-        submission = req.app["db"].submit_quiz(quiz="complexity", name=email, correct=correct, answers=answers)
-        raise aiohttp.web.HTTPFound(location=cig.view.url("complexity", "quiz", submission))
+        try:
+            answers = quiz.pack(int(key[len("stmt-"):]) for key, value in form.items() if key.startswith("stmt-") and value == "1")
+        except ValueError:
+            raise aiohttp.web.HTTPBadRequest(reason="invalid answer")
+        submission = await req.app["db"].submit_quiz(quiz=quiz, name=email, answers=answers)
+        raise aiohttp.web.HTTPFound(location=cig.view.url(lecture.id, "quiz", quiz.id, submission))
+
+
+async def close_db(app: aiohttp.web.Application) -> None:
+    app["db"].close()
+
+
+async def poll_db(app: aiohttp.web.Application) -> AsyncIterator[None]:
+    # Notice writes of other worker processes even when there are no
+    # requests, to push them to live subscribers.
+    async def poll() -> None:
+        while True:
+            await asyncio.sleep(0.5)
+            try:
+                await app["db"].sync()
+            except Exception:
+                logging.exception("Failed to sync database")
+
+    task = asyncio.ensure_future(poll()) if app["db"].shared else None
+    yield
+    if task is not None:
+        task.cancel()
+
+
+async def close_broadcast(app: aiohttp.web.Application) -> None:
+    app["broadcast"].close()
+
+
+async def run_mailer(app: aiohttp.web.Application) -> AsyncIterator[None]:
+    await app["mailer"].start()
+    yield
+    await app["mailer"].stop()
+
+
+async def reload_data(path: str, trigger: asyncio.Event, interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    mtime = os.stat(path).st_mtime_ns
+
+    while True:
+        try:
+            await asyncio.wait_for(trigger.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+        try:
+            current = os.stat(path).st_mtime_ns
+        except OSError:
+            logging.exception("Could not stat data file %s", path)
+            continue
+        if current == mtime and not trigger.is_set():
+            continue
+        trigger.clear()
+        mtime = current
+
+        # Parse and index off the event loop, then swap in the new catalogue
+        # with a single assignment.
+        try:
+            catalogue = await loop.run_in_executor(None, cig.data.load, path)
+        except Exception:
+            logging.exception("Failed to reload data file %s, keeping previous catalogue", path)
+        else:
+            cig.data.CATALOGUE = catalogue
+            logging.info("Reloaded %d lectures and %d events from %s", len(catalogue.lectures), len(catalogue.events), path)
+
+
+async def watch_data(app: aiohttp.web.Application) -> AsyncIterator[None]:
+    # Always handle SIGHUP, even without a data file, so that it does not
+    # kill the process.
+    trigger = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, trigger.set)
+    except (AttributeError, NotImplementedError):
+        pass  # No SIGHUP on this platform
+
+    path = app["data_path"]
+    if not path:
+        yield
+        return
+
+    task = asyncio.ensure_future(reload_data(path, trigger, app["data_reload_interval"]))
+    yield
+    task.cancel()
+
+
+# Optional pragmas in the [database] section. Empty values keep the defaults
+# of SQLite.
+PRAGMAS = ["synchronous", "busy_timeout", "cache_size", "mmap_size"]
+
+
+def open_storage(config: configparser.ConfigParser, *, shared: bool = False) -> cig.db.Storage:
+    engine = config.get("database", "engine")
+    if engine == "memory":
+        return cig.memory.MemoryStorage()
+    elif engine == "sqlite":
+        return cig.db.Database(
+            config.get("database", "path") or cig.db.DEFAULT_PATH,
+            readers=config.getint("database", "readers"),
+            shared=shared,
+            pragmas={key: config.get("database", key) for key in PRAGMAS if config.get("database", key, fallback="")})
+    else:
+        raise ValueError(f"unknown database engine: {engine}")
 
 
 def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="python -m cig")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: from config)")
+    parser.add_argument("--fd", type=int, help=argparse.SUPPRESS)  # Listening socket inherited from the supervisor
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)  # Number of the worker process
+    parser.add_argument("config", nargs="*", help="additional config files")
+    args = parser.parse_args(argv)
+
     logging.basicConfig(level=logging.DEBUG)
 
     config = configparser.ConfigParser()
     config.read([
         os.path.join(os.path.dirname(__file__), "..", "config.default.ini"),
         os.path.join(os.path.dirname(__file__), "..", "config.ini"),
-    ] + argv)
+    ] + args.config)
 
     bind = config.get("server", "bind")
     port = config.getint("server", "port")
+    workers = args.workers if args.workers is not None else config.getint("server", "workers")
+    data_path = config.get("data", "path")
+
+    # Migrations may need the catalogue.
+    if data_path:
+        cig.data.CATALOGUE = cig.data.load(data_path)
+
+    if args.fd is None and workers > 1:
+        if config.get("database", "engine") != "sqlite":
+            parser.error("multiple workers require engine=sqlite")
 
-    app = aiohttp.web.Application()
+        # Migrate once, before the workers open the database.
+        open_storage(config).close()
+        supervisor = cig.supervisor.Supervisor(cig.supervisor.listen(bind, port), args.config, workers=workers)
+        logging.info("Running on http://%s:%d with %d workers", bind, port, workers)
+        supervisor.run()
+        return
+
+    if args.worker is not None:
+        cig.metrics.COMMON_LABELS["worker"] = str(args.worker)
+
+    app = aiohttp.web.Application(middlewares=[cig.metrics.middleware, cig.compress.middleware])
     app["base_url"] = config.get("server", "base_url")
-    app["db"] = cig.db.Database()
+    app["db"] = open_storage(config, shared=args.fd is not None)
+    app["broadcast"] = cig.live.Broadcast(app["db"])
+    app["data_path"] = data_path
+    app["data_reload_interval"] = config.getfloat("data", "reload_interval")
     app["dev"] = config.getboolean("server", "dev")
+    app["behind_proxy"] = config.getboolean("server", "behind_proxy")
+    app["compress_min_size"] = config.getint("server", "compress_min_size") if config.get("server", "compress_min_size") else None
+    app["compress_offload_size"] = config.getint("server", "compress_offload_size")
+    app["email_limiter"] = cig.ratelimit.RateLimiter(
+        burst=config.getint("login", "email_burst"),
+        interval=config.getfloat("login", "email_interval"),
+        max_keys=config.getint("login", "max_keys"))
+    app["ip_limiter"] = cig.ratelimit.RateLimiter(
+        burst=config.getint("login", "ip_burst"),
+        interval=config.getfloat("login", "ip_interval"),
+        max_keys=config.getint("login", "max_keys"))
     app["secret"] = config.get("server", "secret")
-    app["mailgun_domain"] = config.get("mailgun", "domain")
-    app["mailgun_key"] = config.get("mailgun", "key")
+    app["mailer"] = cig.mail.Mailer(
+        cig.mail.MailgunTransport(
+            api=config.get("mailgun", "api"),
+            domain=config.get("mailgun", "domain"),
+            key=config.get("mailgun", "key"),
+        ),
+        workers=config.getint("mailgun", "workers"),
+        queue_size=config.getint("mailgun", "queue_size"),
+        retries=config.getint("mailgun", "retries"),
+    )
+
+    app.on_shutdown.append(close_broadcast)
+    app.on_cleanup.append(close_db)
+    app.cleanup_ctx.append(watch_data)
+    app.cleanup_ctx.append(run_mailer)
+    app.cleanup_ctx.append(poll_db)
 
     app.add_routes(routes)
-    app.router.add_static("/static", os.path.join(os.path.dirname(__file__), "..", "static"))
-    aiohttp.web.run_app(app, host=bind, port=port, access_log=None)
+    app.router.add_get("/static/{path:.+}", cig.assets.handle)
+    if args.fd is not None:
+        aiohttp.web.run_app(app, sock=socket.socket(fileno=args.fd), access_log=None, print=None)
+    else:
+        aiohttp.web.run_app(app, host=bind, port=port, access_log=None)
@@ -0,0 +1,103 @@
+# (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
+
+import asyncio
+import logging
+import signal
+import socket
+import sys
+
+from typing import List, Optional
+
+
+def listen(host: str, port: int, *, backlog: int = 1024) -> socket.socket:
+    family, type, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, type, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    # Runs worker processes that all accept connections on one inherited
+    # listening socket. Crashed workers are restarted.
+    #
+    # SIGTERM, SIGINT: Graceful shutdown of all workers.
+    # SIGHUP: Forwarded to all workers (reloads the data file, if any).
+    # SIGUSR1: Rolling restart, replacing one worker at a time.
+
+    def __init__(self, sock: socket.socket, args: List[str], *, workers: int, restart_delay: float = 1.0) -> None:
+        self.sock = sock
+        self.args = args
+        self.procs: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self.restart_delay = restart_delay
+        self.stopping = False
+        self.restarting = False
+        self.stopped: Optional[asyncio.Event] = None
+
+    def run(self) -> None:
+        asyncio.run(self._run())
+
+    async def _run(self) -> None:
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+        loop.add_signal_handler(signal.SIGHUP, self._forward, signal.SIGHUP)
+        loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(self.restart()))
+
+        for n in range(len(self.procs)):
+            self.procs[n] = await self._spawn(n)
+
+        await self.stopped.wait()
+        await asyncio.gather(*(proc.wait() for proc in self.procs if proc is not None))
+        logging.info("All workers stopped")
+
+    async def _spawn(self, n: int) -> asyncio.subprocess.Process:
+        fd = self.sock.fileno()
+        proc = await asyncio.create_subprocess_exec(sys.executable, "-m", "cig", "--fd", str(fd), "--worker", str(n), *self.args, pass_fds=[fd])
+        logging.info("Started worker %d (pid %d)", n, proc.pid)
+        asyncio.ensure_future(self._watch(n, proc))
+        return proc
+
+    async def _watch(self, n: int, proc: asyncio.subprocess.Process) -> None:
+        code = await proc.wait()
+        if self.stopping or self.procs[n] is not proc:
+            return  # Stopped or replaced on purpose
+
+        logging.error("Worker %d (pid %d) exited with %d, restarting in %.1fs", n, proc.pid, code, self.restart_delay)
+        await asyncio.sleep(self.restart_delay)
+        if not self.stopping and self.procs[n] is proc:
+            self.procs[n] = await self._spawn(n)
+
+    def _forward(self, signum: int) -> None:
+        for proc in self.procs:
+            if proc is not None and proc.returncode is None:
+                proc.send_signal(signum)
+
+    def stop(self) -> None:
+        logging.info("Stopping workers")
+        self.stopping = True
+        self._forward(signal.SIGTERM)
+        assert self.stopped is not None
+        self.stopped.set()
+
+    async def restart(self) -> None:
+        # Start each replacement before stopping the old worker, so that the
+        # socket is never left without workers. The old worker finishes
+        # its requests in flight.
+        if self.restarting:
+            return
+        self.restarting = True
+        try:
+            for n, old in enumerate(self.procs):
+                if self.stopping:
+                    return
+                self.procs[n] = await self._spawn(n)
+                if old is not None and old.returncode is None:
+                    old.terminate()
+                    await old.wait()
+                    logging.info("Replaced worker %d (pid %d)", n, old.pid)
+        finally:
+            self.restarting = False
@@ -1,51 +1,114 @@
 # (c) 2020 Niklas Fiekas <niklas.fiekas@tu-clausthal.de>
 
+from __future__ import annotations
+
 import pytz
+import contextvars
 import datetime
+import functools
 import itertools
 
+import cig.assets
 import cig.data
 import cig.db
 
 from cig.db import Registrations, Row
-from cig.data import Lecture
-from cig.example_quiz import Statement
-from tinyhtml import Frag, h, html, raw, frag
+from cig.data import Lecture, Event, Quiz, Statement
+from tinyhtml import Frag, h, html, raw, frag, render
 from urllib.parse import quote as urlquote
-from typing import List, Optional, Callable, Union
+from typing import List, Optional, Callable, Union, Dict, Tuple, Iterator, Sequence
 
 
-def layout(title: Optional[str], body: Frag) -> Frag:
-    return html(lang="de")(
+# Markers to split the pre-rendered shell of the layout.
+TITLE_MARK = "\x00title\x00"
+BODY_MARK = "\x00body\x00"
+CLOCK_MARK = "\x00clock\x00"
+
+
+def shell() -> List[str]:
+    rendered = html(lang="de")(
         raw("<!-- https://github.com/niklasf/cig-lectures -->"),
         h("head")(
             h("meta", charset="utf-8"),
             h("meta", name="viewport", content="width=device-width,initial-scale=1"),
-            h("title")("CIG Lectures WS2020", f": {title}" if title else None),
-            h("link", rel="stylesheet", href="/static/style.css"),
-            h("link", rel="shortcut icon", href="/static/tuc/favicon.ico"),
+            h("title")("CIG Lectures WS2020", raw(TITLE_MARK)),
+            h("link", rel="stylesheet", href=cig.assets.url("style.css")),
+            h("link", rel="shortcut icon", href=cig.assets.url("tuc/favicon.ico")),
         ),
         h("body")(
             h("header")(
-                h("img", src="/static/tuc/logo.svg", klass="no-print"),
+                h("img", src=cig.assets.url("tuc/logo.svg"), klass="no-print"),
             ),
-            h("main")(body),
+            h("main")(raw(BODY_MARK)),
             h("footer")(
-                "Server time: ", cig.db.now().strftime("%d.%m.%Y %H:%M:%S"), ". ",
+                "Server time: ", raw(CLOCK_MARK), ". ",
                 "This program is free/libre open source software. ",
                 h("a", href="https://github.com/niklasf/cig-lectures")("GitHub"), ".",
             ),
         ),
+    ).render()
+    head, rest = rendered.split(TITLE_MARK)
+    mid, rest = rest.split(BODY_MARK)
+    footer, tail = rest.split(CLOCK_MARK)
+    return [head, mid, footer, tail]
+
+
+SHELL = shell()
+
+# Set while rendering pages for the static cache, which leaves a marker in
+# place of the clock.
+_caching: contextvars.ContextVar[bool] = contextvars.ContextVar("caching", default=False)
+
+
+def clock() -> Frag:
+    return raw(CLOCK_MARK if _caching.get() else cig.db.now().strftime("%d.%m.%Y %H:%M:%S"))
+
+
+def layout(title: Optional[str], body: Frag) -> Frag:
+    return frag(
+        raw(SHELL[0]),
+        f": {title}" if title else None,
+        raw(SHELL[1]),
+        body,
+        raw(SHELL[2]),
+        clock(),
+        raw(SHELL[3]),
     )
 
 
+_static: Dict[Tuple[str, ...], Tuple[bytes, bytes]] = {}
+_static_digest = ""
+
+
+def static(key: Tuple[str, ...], page: Callable[[], Frag]) -> bytes:
+    # Pages that are the same for every visitor are rendered once and cached
+    # as encoded bytes, until the catalogue changes.
+    global _static_digest
+    if _static_digest != cig.data.CATALOGUE.digest:
+        _static.clear()
+        _static_digest = cig.data.CATALOGUE.digest
+
+    try:
+        head, tail = _static[key]
+    except KeyError:
+        token = _caching.set(True)
+        try:
+            rendered = page().render()
+        finally:
+            _caching.reset(token)
+        before, _, after = rendered.partition(CLOCK_MARK)
+        head, tail = _static[key] = before.encode("utf-8"), after.encode("utf-8")
+
+    return b"".join([head, clock().render().encode("utf-8"), tail])
+
+
 def index() -> Frag:
     return layout(None, frag(
         h("h1")("CIG Lectures WS2020"),
         h("ul")(
             h("li")(
                 h("a", href=url(name))(lecture.title)
-            ) for name, lecture in cig.data.LECTURES.items()
+            ) for name, lecture in cig.data.CATALOGUE.lectures.items()
         ),
     ))
 
@@ -96,17 +159,112 @@ def link_sent(*, title: str, email_text: Optional[str]) -> Frag:
     ))
 
 
-def register(*, lecture: Lecture, email: str, events: List[Registrations], admin: bool = False, today: datetime.date) -> Frag:
-    def modifier(row: Row) -> Callable[[str], Frag]:
-        if row.deleted and row.admin:
-            return lambda *children: h("del")(h("ins")(*children))
-        elif row.deleted:
-            return h("del")
-        elif row.admin:
-            return h("ins")
-        else:
-            return h("span")
+def modifier(row: Row) -> Callable[[str], Frag]:
+    if row.deleted and row.admin:
+        return lambda *children: h("del")(h("ins")(*children))
+    elif row.deleted:
+        return h("del")
+    elif row.admin:
+        return h("ins")
+    else:
+        return h("span")
+
+
+def table_row(event: Event, row: Row, *, email: str, admin: bool) -> Frag:
+    return h("tr", klass={
+        "me": row.name == email,
+        "overhang": row.n is not None and row.n <= 0,
+    })(
+        h("td")(modifier(row)(f"#{row.n}") if row.n is not None else ""),
+        h("td")(modifier(row)(row.name)),
+        h("td")(
+            "Reservation deleted by admin" if row.deleted else cig.db.localtime(row.time).strftime("Successfully registered %d.%m. %H:%M" if row.n is not None and row.n > 0 else "Seat not available (%d.%m. %H:%M). We will make sure to provide the lecture materials online."),
+        ),
+        h("td", klass="no-print")(
+            h("form", method="POST")(
+                h("input", type="hidden", name="name", value=row.name),
+                h("input", type="hidden", name="restore" if row.deleted else "delete", value=event.id),
+                h("button")("Restore" if row.deleted else "Delete"),
+            )
+        ) if admin else None,
+    )
+
 
+def visible_rows(registrations: Registrations, *, email: str, admin: bool) -> List[Row]:
+    if admin:
+        return registrations.rows()
+    mine = registrations.row(email)
+    return [mine] if mine is not None else []
+
+
+def bulk_form(event: Event, targets: Sequence[Event]) -> Frag:
+    return h("details", klass="no-print")(
+        h("summary")("Bulk actions"),
+        h("form", method="POST", enctype="multipart/form-data")(
+            h("input", type="hidden", name="event", value=event.id),
+            h("p")(
+                h("textarea", name="names", rows=4, placeholder="One name per line")(),
+            ),
+            h("p")(
+                h("label")("Or CSV file with a name column: ", h("input", type="file", name="csv", accept=".csv,text/csv")),
+            ),
+            h("p")(
+                h("button", type="submit", name="bulk", value="register")("Reserve seats"), " ",
+                h("button", type="submit", name="bulk", value="delete")("Delete"), " ",
+                h("button", type="submit", name="bulk", value="restore")("Restore"),
+            ),
+            h("p")(
+                h("button", type="submit", name="bulk", value="delete-all", onclick="return confirm('Delete all reservations for this event?')")("Delete all"), " ",
+                h("button", type="submit", name="bulk", value="restore-all")("Restore all"),
+            ),
+            h("p")(
+                h("select", name="target")(
+                    h("option", value=target.id)(target.title, " (", target.date.strftime("%a, %d.%m."), ")") for target in targets if target != event
+                ), " ",
+                h("button", type="submit", name="bulk", value="copy")("Copy reservations"),
+            ) if len(targets) > 1 else None,
+        ),
+    )
+
+
+def section(registrations: Registrations, *, email: str, admin: bool, today: datetime.date, rows: Union[Frag, List[Frag]], targets: Sequence[Event] = ()) -> Frag:
+    event = registrations.event
+    registered = registrations.has(email)
+    return h("section", klass={
+        "not-today": event.date != today,
+    })(
+        h("h2", id=f"event-{event.id}")(
+            event.title, " (", event.date.strftime("%a, %d.%m."), ")",
+        ),
+        h("p")("Please reserve a seat only if you will physically attend this lecture in ", h("strong")(event.location), " on this particular day."),
+        h("p")(
+            "Please come only after you successfully reserved a seat. There are ", h("strong")(f"{event.seats} seats"), " in total, ",
+            h("strong", id=f"free-{event.id}")(registrations.free_seats()), " still available.",
+        ),
+        h("p", klass="live-changed no-print", id=f"changed-{event.id}", hidden=True)(
+            "Registrations have changed. ", h("a", href="")("Reload"),
+        ) if admin else None,
+        h("table")(
+            h("thead")(
+                h("tr")(
+                    h("th")("Seat"),
+                    h("th")("Name"),
+                    h("th")("Status"),
+                    h("th", klass="no-print")("Admin") if admin else None,
+                )
+            ),
+            h("tbody")(rows)
+        ) if admin or registered else None,
+        h("form", method="POST", onsubmit="return confirm('Please register only if you will physically attend the lecture on this particular day.')" if not admin else None)(
+            h("input", type="text", name="name", placeholder=email) if admin else None,
+            h("input", type="hidden", name="reserve", value=event.id),
+            h("button", type="submit")("Reserve seat (admin)" if admin else "Reserve seat"),
+        ) if admin or not registered else None,
+        bulk_form(event, targets) if admin else None,
+    )
+
+
+def register_page(*, lecture: Lecture, email: str, sections: Optional[Frag]) -> Frag:
     return layout(lecture.title, frag(
         h("h1", klass="no-print")("Register for the next ", h("em")(lecture.title), " lecture (step 3/3)"),
         h("section")(
@@ -117,62 +275,78 @@ def register(*, lecture: Lecture, email: str, events: List[Registrations], admin
             h("p")(
                 h("button", disabled=True)("Reserve seat"),
             ),
-        ) if not events else [
-            h("section", klass={
-                "not-today": registrations.event.date != today,
-            })(
-                h("h2", id=f"event-{registrations.event.id}")(
-                    registrations.event.title, " (", registrations.event.date.strftime("%a, %d.%m."), ")",
-                ),
-                h("p")("Please reserve a seat only if you will physically attend this lecture in ", h("strong")(registrations.event.location), " on this particular day."),
-                h("p")("Please come only after you successfully reserved a seat. There are ", h("strong")(f"{registrations.event.seats} seats"), " in total."),
-                h("table")(
-                    h("thead")(
-                        h("tr")(
-                            h("th")("Seat"),
-                            h("th")("Name"),
-                            h("th")("Status"),
-                            h("th", klass="no-print")("Admin") if admin else None,
-                        )
-                    ),
-                    h("tbody")([
-                        h("tr", klass={
-                            "me": row.name == email,
-                            "overhang": row.n is not None and row.n <= 0,
-                        })(
-                            h("td")(modifier(row)(f"#{row.n}") if row.n is not None else ""),
-                            h("td")(modifier(row)(row.name)),
-                            h("td")(
-                                "Reservation deleted by admin" if row.deleted else row.time.strftime("Successfully registered %d.%m. %H:%M" if row.n is not None and row.n > 0 else "Seat not available (%d.%m. %H:%M). We will make sure to provide the lecture materials online."),
-                            ),
-                            h("td", klass="no-print")(
-                                h("form", method="POST")(
-                                    h("input", type="hidden", name="name", value=row.name),
-                                    h("input", type="hidden", name="restore" if row.deleted else "delete", value=registrations.event.id),
-                                    h("button")("Restore" if row.deleted else "Delete"),
-                                )
-                            ) if admin else None,
-                        ) for row in registrations.rows() if row.name == email or admin
-                    ])
-                ) if admin or registrations.has(email) else None,
-                h("form", method="POST", onsubmit="return confirm('Please register only if you will physically attend the lecture on this particular day.')" if not admin else None)(
-                    h("input", type="text", name="name", placeholder=email) if admin else None,
-                    h("input", type="hidden", name="reserve", value=registrations.event.id),
-                    h("button", type="submit")("Reserve seat (admin)" if admin else "Reserve seat"),
-                ) if admin or not registrations.has(email) else None,
-            ) for registrations in events
-        ],
+        ) if sections is None else sections,
         h("section", klass="no-print")(
             h("h2")("Your contact information"),
             h("p")("You are logged in as ", h("strong")(email), "."),
             h("p")("We do not need additional contact information at this time. But please keep your details updated with the Studentensekretariat."),
         ),
+        h("script", src=cig.assets.url("live.js"), defer=True)() if sections is not None else None,
     ))
 
 
-def quiz(*, email: Optional[str], statements: List[Statement], answers: Optional[List[bool]], correct: Optional[int]) -> Frag:
-    return layout("Complexity Theory", frag(
-        h("h1")(h("em")("Complexity Theory"), " self assessment quiz"),
+def register(*, lecture: Lecture, email: str, events: List[Registrations], admin: bool = False, today: datetime.date) -> Frag:
+    return register_page(lecture=lecture, email=email, sections=frag(
+        section(registrations, email=email, admin=admin, today=today, rows=[
+            table_row(registrations.event, row, email=email, admin=admin) for row in visible_rows(registrations, email=email, admin=admin)
+        ], targets=[r.event for r in events]) for registrations in events
+    ) if events else None)
+
+
+SECTIONS_MARK = "\x00sections\x00"
+ROWS_MARK = "\x00rows\x00"
+
+
+def register_chunks(*, lecture: Lecture, email: str, events: List[Registrations], admin: bool = False, today: datetime.date, chunk_size: int = 100) -> Iterator[str]:
+    # Same as register(), but rendered incrementally: the page head, then
+    # each section with its rows in chunks, then the rest of the page.
+    if not events:
+        yield register(lecture=lecture, email=email, events=events, admin=admin, today=today).render()
+        return
+
+    head, _, tail = register_page(lecture=lecture, email=email, sections=raw(SECTIONS_MARK)).render().partition(SECTIONS_MARK)
+    yield head
+
+    targets = [r.event for r in events]
+    for registrations in events:
+        before, _, after = section(registrations, email=email, admin=admin, today=today, rows=raw(ROWS_MARK), targets=targets).render().partition(ROWS_MARK)
+        yield before
+        rows = visible_rows(registrations, email=email, admin=admin)
+        for i in range(0, len(rows), chunk_size):
+            yield render(table_row(registrations.event, row, email=email, admin=admin) for row in rows[i:i + chunk_size])
+        yield after
+
+    yield tail
+
+
+def quiz_row(i: int, statement: Optional[Statement], answer: Optional[bool]) -> Frag:
+    return h("tr", klass={
+        "correct": statement is not None and answer is statement.truth,
+        "incorrect": statement is not None and answer is (not statement.truth),
+    })(
+        h("td")(i, "."),
+        h("td")(statement.text if statement is not None else None),
+        h("td")(
+            h("input", type="radio", name=f"stmt-{i}", id=f"stmt-{i}-1", value=1, required=True, checked=answer is True, disabled=answer is not None),
+            h("label", for_=f"stmt-{i}-1")("True"),
+        ),
+        h("td")(
+            h("input", type="radio", name=f"stmt-{i}", id=f"stmt-{i}-0", value=0, required=True, checked=answer is False, disabled=answer is not None),
+            h("label", for_=f"stmt-{i}-0")("False"),
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def blank_quiz_rows(quiz: Quiz) -> str:
+    # The unanswered form is the same for everyone.
+    return render(frag(quiz_row(i, statement, None) for i, statement in enumerate(quiz.statements)))
+
+
+def quiz(*, lecture: Lecture, quiz: Quiz, email: Optional[str], answers: Optional[List[bool]], correct: Optional[int]) -> Frag:
+    statements = quiz.statements
+    return layout(lecture.title, frag(
+        h("h1")(h("em")(lecture.title), " self assessment quiz"),
         frag(
             h("h2")("What is saved?"),
             h("ul")(
@@ -183,27 +357,14 @@ def quiz(*, email: Optional[str], statements: List[Statement], answers: Optional
         ) if email is not None else None,
         h("h2")("True or false?"),
         h("p")(
-            "These following are considered basic questions from ", h("em")("Informatics III"), ". ",
-            "Use these in your decision, if you're ready to take the course. ",
+            quiz.description, " " if quiz.description else None,
             "Your answers are anonymous (and therefore obviously not graded).",
         ),
         h("form", method="POST")(
             h("table")(
-                h("tr", klass={
-                    "correct": answer is statement.truth,
-                    "incorrect": answer is (not statement.truth),
-                })(
-                    h("td")(i, "."),
-                    h("td")(statement.text),
-                    h("td")(
-                        h("input", type="radio", name=f"stmt-{i}", id=f"stmt-{i}-1", value=1, required=True, checked=answer is True, disabled=answer is not None),
-                        h("label", for_=f"stmt-{i}-1")("True"),
-                    ),
-                    h("td")(
-                        h("input", type="radio", name=f"stmt-{i}", id=f"stmt-{i}-0", value=0, required=True, checked=answer is False, disabled=answer is not None),
-                        h("label", for_=f"stmt-{i}-0")("False"),
-                    ),
-                ) for i, statement, answer in itertools.zip_longest(range(len(statements)), statements, answers or [])
+                raw(blank_quiz_rows(quiz)) if answers is None else frag(
+                    quiz_row(i, statement, answer) for i, statement, answer in itertools.zip_longest(range(len(statements)), statements, answers)
+                ),
             ),
             h("button", type="submit")("Submit answers") if not answers else None,
             h("p")("You scored ", h("strong")(round(correct / len(statements) * 100), "%"), ".") if correct is not None else None,
@@ -1,16 +1,29 @@
+-- Schema of new databases. Existing databases are upgraded by the
+-- migrations in cig/db.py. Keep both in sync.
+
 -- Registrations
 
 CREATE TABLE IF NOT EXISTS registrations (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     event INTEGER NOT NULL,
     name VARCHAR(128) NOT NULL,
-    time DATETIME NOT NULL,
+    time INTEGER NOT NULL, -- Microseconds since the epoch
     admin BOOLEAN NOT NULL,
-    deleted BOOLEAN NOT NULL
+    deleted BOOLEAN NOT NULL,
+    seat INTEGER -- NULL if deleted or waitlisted
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_event_name ON registrations (event, name);
 
+CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_event_seat ON registrations (event, seat);
+
+CREATE INDEX IF NOT EXISTS idx_registrations_name_event ON registrations (name, event) WHERE seat IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS event_versions (
+    event INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
 -- Quiz
 
 CREATE TABLE IF NOT EXISTS quiz_participants (
@@ -24,6 +37,27 @@ CREATE TABLE IF NOT EXISTS quiz_answers (
     id VARCHAR(32) PRIMARY KEY,
     quiz VARCHAR(128) NOT NULL,
     correct INTEGER NOT NULL,
-    answers TEXT NOT NULL,
+    answers BLOB NOT NULL, -- Bitmask, see cig.data.pack_answers() and cig.db.encode_answers()
     first BOOLEAN NOT NULL
 );
+
+CREATE INDEX IF NOT EXISTS idx_quiz_answers_quiz ON quiz_answers (quiz);
+
+-- Running totals by first or repeated attempt
+
+CREATE TABLE IF NOT EXISTS quiz_statement_stats (
+    quiz VARCHAR(128) NOT NULL,
+    first BOOLEAN NOT NULL,
+    statement INTEGER NOT NULL,
+    correct INTEGER NOT NULL,
+    incorrect INTEGER NOT NULL,
+    PRIMARY KEY (quiz, first, statement)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS quiz_score_stats (
+    quiz VARCHAR(128) NOT NULL,
+    first BOOLEAN NOT NULL,
+    score INTEGER NOT NULL, -- Number of correct answers
+    count INTEGER NOT NULL,
+    PRIMARY KEY (quiz, first, score)
+) WITHOUT ROWID;
@@ -0,0 +1,23 @@
+// Progressive enhancement: live seat availability on lecture pages.
+(function () {
+  'use strict';
+
+  if (!window.EventSource) return;
+
+  var source = new EventSource(location.pathname.replace(/\/+$/, '') + '/live' + location.search);
+
+  function update(e) {
+    var data = JSON.parse(e.data);
+    var free = document.getElementById('free-' + data.event);
+    if (free) free.textContent = data.free;
+    return data;
+  }
+
+  source.addEventListener('snapshot', update);
+
+  source.addEventListener('seats', function (e) {
+    var data = update(e);
+    var changed = document.getElementById('changed-' + data.event);
+    if (changed) changed.hidden = false;
+  });
+})();